@@ -1,29 +1,39 @@
-from typing import List, Dict, Union, Any
+from typing import List, Dict, Union, Any, Iterator
 from datetime import datetime
-from collections import defaultdict
-import statistics
+from functools import lru_cache
+from itertools import islice
+from operator import itemgetter
+import re
+import numpy as np
 import pandas as pd
 
+_ISO_DATE_RE = re.compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})$')
+_DAY_FIRST_DATE_RE = re.compile(r'^(\d{1,2})-(\d{1,2})-(\d{4})$')
+_SHORT_YEAR_DATE_RE = re.compile(r'^(\d{2})-(\d{1,2})-(\d{1,2})$')
+
+REQUIRED_TRANSACTION_FIELDS = {
+    'date': str,
+    'description': str,
+    'debit': (int, float),
+    'credit': (int, float),
+    'balance': (int, float, str),  # Some balance values might be strings
+    'category': str
+}
+REQUIRED_TRANSACTION_KEYS = frozenset(REQUIRED_TRANSACTION_FIELDS)
+
+TRANSACTION_CHUNK_ROWS = 16384  # Rows converted at a time when transactions arrive as an iterator
+
 def validate_transaction(transaction: Dict[str, Any]) -> bool:
     """Validate if a transaction has all required fields and correct data types."""
     try:
-        required_fields = {
-            'date': str,
-            'description': str,
-            'debit': (int, float),
-            'credit': (int, float),
-            'balance': (int, float, str),  # Some balance values might be strings
-            'category': str
-        }
-        
         # Check all required fields exist
-        if not all(field in transaction for field in required_fields):
-            missing_fields = [f for f in required_fields if f not in transaction]
+        if not REQUIRED_TRANSACTION_KEYS <= transaction.keys():
+            missing_fields = [f for f in REQUIRED_TRANSACTION_FIELDS if f not in transaction]
             print(f"Missing required fields in transaction: {missing_fields}")
             return False
         
         # Check data types
-        for field, expected_type in required_fields.items():
+        for field, expected_type in REQUIRED_TRANSACTION_FIELDS.items():
             value = transaction[field]
             if field == 'balance' and isinstance(value, str):
                 # Try to convert string balance to float
@@ -46,6 +56,61 @@ def validate_transaction(transaction: Dict[str, Any]) -> bool:
         print(f"Error validating transaction: {str(e)}")
         return False
 
+# Inferred dtypes of object columns holding only ints, floats (NaN included) and bools
+NUMBER_INFERRED_DTYPES = frozenset({'integer', 'integer-na', 'floating', 'mixed-integer-float', 'boolean'})
+# Exact value types passing isinstance(value, (int, float)) among those GPT output and pandas produce
+NUMBER_VALUE_TYPES = (int, float, bool, np.float64)
+
+def _is_str_column(column: pd.Series) -> pd.Series:
+    """Mask of values in a column that are strings."""
+    if pd.api.types.is_numeric_dtype(column) or pd.api.types.is_datetime64_any_dtype(column):
+        return pd.Series(False, index=column.index)
+    if pd.api.types.infer_dtype(column, skipna=False) == 'string':
+        return pd.Series(True, index=column.index)
+    # Mixed columns: compare each value's type, since lists and dicts also have a length
+    return column.map(type).eq(str)
+
+def _is_number_column(column: pd.Series) -> pd.Series:
+    """Mask of values in a column that are ints or floats."""
+    if pd.api.types.is_numeric_dtype(column):
+        return pd.Series(True, index=column.index)
+    if pd.api.types.infer_dtype(column, skipna=False) in NUMBER_INFERRED_DTYPES:
+        return pd.Series(True, index=column.index)
+    return column.map(type).isin(NUMBER_VALUE_TYPES)
+
+def validate_transactions_df(df: pd.DataFrame) -> pd.Series:
+    """
+    Vectorized counterpart of validate_transaction for a DataFrame of transactions.
+    Returns a boolean mask that is True for rows passing the same checks.
+    """
+    missing_fields = [f for f in REQUIRED_TRANSACTION_FIELDS if f not in df.columns]
+    if missing_fields:
+        print(f"Missing required fields in transactions: {missing_fields}")
+        return pd.Series(False, index=df.index)
+
+    mask = (
+        _is_str_column(df['date'])
+        & _is_str_column(df['description'])
+        & _is_number_column(df['debit'])
+        & _is_number_column(df['credit'])
+    )
+
+    # Balance may be numeric or a string with thousands separators
+    balance = df['balance']
+    balance_text = balance.astype(str).str.replace(',', '', regex=False)
+    mask &= _is_number_column(balance) | (
+        _is_str_column(balance) & pd.to_numeric(balance_text, errors='coerce').notna()
+    )
+
+    # Validate category format
+    mask &= _is_str_column(df['category']) & df['category'].astype(str).str.contains('.', regex=False)
+
+    invalid_count = int((~mask).sum())
+    if invalid_count:
+        print(f"Found {invalid_count} invalid transactions")
+    return mask
+
+@lru_cache(maxsize=4096)
 def parse_date(date_str: str) -> Union[datetime, None]:
     """
     Parse date string to datetime object.
@@ -53,21 +118,32 @@ def parse_date(date_str: str) -> Union[datetime, None]:
     - YYYY-MM-DD
     - DD-MM-YYYY
     - YY-MM-DD
+
+    Results are memoized since statements repeat the same date strings
+    across many transactions.
     """
+    # Dispatch on the shape of the string instead of a strptime fallback chain
     try:
-        return datetime.strptime(date_str, '%Y-%m-%d')
-    except ValueError:
-        try:
-            return datetime.strptime(date_str, '%d-%m-%Y')
-        except ValueError:
-            try:
-                # Handle YY-MM-DD format
-                dt = datetime.strptime(date_str, '%y-%m-%d')
-                # Assume 20xx for year
-                return dt.replace(year=dt.year + 2000)
-            except ValueError as e:
-                print(f"Failed to parse date {date_str}: {str(e)}")
-                return None
+        match = _ISO_DATE_RE.match(date_str)
+        if match:
+            year, month, day = match.groups()
+            return datetime(int(year), int(month), int(day))
+
+        match = _DAY_FIRST_DATE_RE.match(date_str)
+        if match:
+            day, month, year = match.groups()
+            return datetime(int(year), int(month), int(day))
+
+        match = _SHORT_YEAR_DATE_RE.match(date_str)
+        if match:
+            year, month, day = match.groups()
+            # Assume 20xx for year
+            return datetime(2000 + int(year), int(month), int(day))
+
+        raise ValueError("unsupported date format")
+    except (ValueError, TypeError) as e:
+        print(f"Failed to parse date {date_str}: {str(e)}")
+        return None
 
 def get_month_key(date_str: str) -> str:
     """Extract YYYY-MM from date string."""
@@ -104,132 +180,160 @@ def calculate_monthly_summary(transactions: List[Dict]) -> Dict:
         ...
     }
     """
-    monthly_summary = defaultdict(lambda: {
-        "total_income": 0.0,
-        "total_expense": 0.0,
-        "net_cash_flow": 0.0,
-        "categories": defaultdict(float),
-        "transaction_count": 0
-    })
-    
-    for transaction in transactions:
-        date = parse_date(transaction['date'])
-        month_key = get_month_key(transaction['date'])
-        category = transaction['category']
-        
-        # Update category amounts
-        if transaction['credit'] > 0:
-            monthly_summary[month_key]["total_income"] += transaction['credit']
-            monthly_summary[month_key]["categories"][category] += transaction['credit']
-        if transaction['debit'] > 0:
-            monthly_summary[month_key]["total_expense"] += transaction['debit']
-            monthly_summary[month_key]["categories"][category] += transaction['debit']
-        
-        # Update net cash flow
-        monthly_summary[month_key]["net_cash_flow"] = (
-            monthly_summary[month_key]["total_income"] - 
-            monthly_summary[month_key]["total_expense"]
-        )
-        
-        # Increment transaction count
-        monthly_summary[month_key]["transaction_count"] += 1
-    
-    # Convert defaultdict to regular dict
-    return {
-        month: dict(data) for month, data in monthly_summary.items()
-    }
+    df = pd.DataFrame(transactions)
+    if df.empty:
+        return {}
+
+    # Structure-of-arrays view: integer ids for months/categories and float amount arrays
+    month_ids, months = pd.factorize(df['date'].str.slice(0, 7), use_na_sentinel=False)
+    category_ids, categories = pd.factorize(df['category'], use_na_sentinel=False)
+    credit = df['credit'].to_numpy(dtype=np.float64)
+    debit = df['debit'].to_numpy(dtype=np.float64)
+    income = np.where(credit > 0, credit, 0.0)
+    expense = np.where(debit > 0, debit, 0.0)
+
+    # Accumulate into dense month x category matrices in one pass each
+    n_months, n_categories = len(months), len(categories)
+    cell_ids = month_ids * n_categories + category_ids
+    amounts = np.bincount(cell_ids, weights=income + expense, minlength=n_months * n_categories)
+    amounts = amounts.reshape(n_months, n_categories)
+    total_income = np.bincount(month_ids, weights=income, minlength=n_months)
+    total_expense = np.bincount(month_ids, weights=expense, minlength=n_months)
+    transaction_count = np.bincount(month_ids, minlength=n_months)
+    net_cash_flow = total_income - total_expense
+
+    monthly_summary = {}
+    for m, month in enumerate(months):
+        # Categories only receive an entry once they have a positive amount
+        present = np.flatnonzero(amounts[m] > 0)
+        monthly_summary[month] = {
+            "total_income": float(total_income[m]),
+            "total_expense": float(total_expense[m]),
+            "net_cash_flow": float(net_cash_flow[m]),
+            "categories": {categories[c]: float(amounts[m, c]) for c in present},
+            "transaction_count": int(transaction_count[m])
+        }
+    return monthly_summary
 
-def calculate_median_summary(monthly_summary: Dict) -> Dict:
+def _parse_date_column(dates: pd.Series) -> pd.Series:
     """
-    Calculate median values across all months.
-    
-    Returns:
-    {
-        "median_income": 45000.0,
-        "median_expense": 30000.0,
-        "median_net_cash_flow": 15000.0,
-        "median_by_category": {
-            "income.salary": 45000.0,
-            "expense.food": 8000.0,
-            ...
-        },
-        "median_transaction_count": 25
-    }
+    Parse a column of date strings with a single explicit format picked from the first value.
+    Values that do not match it fall back to pandas' slower mixed-format parser.
     """
-    # Initialize lists to store monthly values
-    all_incomes = []
-    all_expenses = []
-    all_net_cash_flows = []
-    all_transaction_counts = []
-    category_values = defaultdict(list)
-    
-    # Collect values across months
-    for month_data in monthly_summary.values():
-        all_incomes.append(month_data["total_income"])
-        all_expenses.append(month_data["total_expense"])
-        all_net_cash_flows.append(month_data["net_cash_flow"])
-        all_transaction_counts.append(month_data["transaction_count"])
-        
-        # Collect category values
-        for category, amount in month_data["categories"].items():
-            category_values[category].append(amount)
-    
-    # Calculate medians
-    median_summary = {
-        "median_income": statistics.median(all_incomes) if all_incomes else 0.0,
-        "median_expense": statistics.median(all_expenses) if all_expenses else 0.0,
-        "median_net_cash_flow": statistics.median(all_net_cash_flows) if all_net_cash_flows else 0.0,
-        "median_transaction_count": statistics.median(all_transaction_counts) if all_transaction_counts else 0,
-        "median_by_category": {
-            category: statistics.median(values) if values else 0.0
-            for category, values in category_values.items()
-        }
-    }
-    
-    return median_summary
+    sample = dates.dropna()
+    sample = str(sample.iloc[0]) if not sample.empty else ''
+    if _ISO_DATE_RE.match(sample):
+        date_format = '%Y-%m-%d'
+    elif _DAY_FIRST_DATE_RE.match(sample):
+        date_format = '%d-%m-%Y'
+    else:
+        return pd.to_datetime(dates, format='mixed', dayfirst=True)
+
+    parsed = pd.to_datetime(dates, format=date_format, errors='coerce', cache=True)
+    unparsed = parsed.isna() & dates.notna()
+    if unparsed.any():
+        parsed[unparsed] = pd.to_datetime(dates[unparsed], format='mixed', dayfirst=True)
+    return parsed
+
+def _to_amount_column(column: pd.Series) -> pd.Series:
+    """Convert an amount column to floats with missing values as 0.0, skipping work already done."""
+    if not pd.api.types.is_numeric_dtype(column):
+        column = pd.to_numeric(column, errors='coerce')
+    return column.fillna(0.0) if column.hasnans else column
+
+def _frame_from_iterator(transactions: Iterator[Dict]) -> pd.DataFrame:
+    """
+    Build a transaction DataFrame from an iterator in bounded chunks.
+    Dates and amounts are converted per chunk, so only one chunk of raw
+    dicts and parsing temporaries is alive at a time.
+    """
+    columns = list(REQUIRED_TRANSACTION_FIELDS)
+    frames = []
+    while True:
+        chunk = list(islice(transactions, TRANSACTION_CHUNK_ROWS))
+        if not chunk:
+            break
+        frame = pd.DataFrame(chunk, columns=columns)
+        frame['date'] = _parse_date_column(frame['date'])
+        frame['debit'] = _to_amount_column(frame['debit'])
+        frame['credit'] = _to_amount_column(frame['credit'])
+        frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
 
-def prepare_transaction_dataframe(response_data: Dict[str, Any]) -> pd.DataFrame:
+def prepare_transaction_dataframe(response_data: Union[Dict[str, Any], List[Dict], Iterator[Dict], pd.DataFrame]) -> pd.DataFrame:
     """
     Convert API response data into a pandas DataFrame and prepare it for analysis.
-    Handles both list and dict input formats.
+    Handles list, dict, iterator and DataFrame input formats; columns that are
+    already typed are not converted again.
     """
-    # Extract transactions from response, handling both formats
-    if isinstance(response_data, list):
-        transactions = response_data
+    # Extract transactions from response, handling all formats
+    if isinstance(response_data, pd.DataFrame):
+        # Shallow copy so the derived columns are not added to the caller's frame
+        df = response_data.copy(deep=False)
+    elif isinstance(response_data, list):
+        df = pd.DataFrame(response_data)
     elif isinstance(response_data, dict):
-        transactions = response_data.get("data", {}).get("analysis", [])
+        df = pd.DataFrame(response_data.get("data", {}).get("analysis", []))
+    elif isinstance(response_data, Iterator):
+        try:
+            df = _frame_from_iterator(response_data)
+        except Exception as e:
+            print(f"[ERROR] Error preparing DataFrame: {str(e)}")
+            return pd.DataFrame()
     else:
         print(f"[ERROR] Unexpected input type: {type(response_data)}")
         return pd.DataFrame()
     
-    # Create DataFrame
-    df = pd.DataFrame(transactions)
-    
     if df.empty:
         print("[WARNING] No transactions found in input data")
         return df
     
     try:
-        # Convert date using mixed format parsing
-        df['date'] = pd.to_datetime(df['date'], format='mixed', dayfirst=True)
+        # Convert dates, using an explicit format when the column allows it
+        if not pd.api.types.is_datetime64_any_dtype(df['date']):
+            df['date'] = _parse_date_column(df['date'])
         df['month'] = df['date'].dt.to_period('M')
         
         # Convert numeric columns
-        df['debit'] = pd.to_numeric(df['debit'], errors='coerce').fillna(0.0)
-        df['credit'] = pd.to_numeric(df['credit'], errors='coerce').fillna(0.0)
+        df['debit'] = _to_amount_column(df['debit'])
+        df['credit'] = _to_amount_column(df['credit'])
         
         # Split category into type and subcategory
-        df['category_type'] = df['category'].str.split('.').str[0].str.lower()
-        df['sub_category'] = df['category'].str.split('.').str[1]
+        category_parts = df['category'].str.split('.', n=1, expand=True).reindex(columns=[0, 1])
+        df['category_type'] = category_parts[0].str.lower()
+        df['sub_category'] = category_parts[1]
+        
+        # Categorical keys let groupby work on small integer codes instead of hashing strings
+        df['month'] = df['month'].astype('category')
+        df['category_type'] = df['category_type'].astype('category')
+        df['sub_category'] = df['sub_category'].astype('category')
         
         return df
     except Exception as e:
         print(f"[ERROR] Error preparing DataFrame: {str(e)}")
         return pd.DataFrame()
 
-def calculate_monthly_breakdown(df: pd.DataFrame) -> List[Dict]:
+def _compute_grouped(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Sum debit and credit per month, category type and subcategory.
+    Shared by the monthly breakdown and the median summary so the
+    transactions are only grouped once.
+    """
+    return df.groupby(['month', 'category_type', 'sub_category'], observed=True)[['debit', 'credit']].sum().reset_index()
+
+def _category_amounts(grouped_data: pd.DataFrame, category_type: str, amount_column: str) -> pd.DataFrame:
+    """Select the positive per-month amounts of one category type from the grouped data."""
+    mask = (grouped_data['category_type'] == category_type) & (grouped_data[amount_column] > 0)
+    return grouped_data.loc[mask, ['month', 'sub_category', amount_column]].rename(
+        columns={'sub_category': 'category', amount_column: 'amount'}
+    )
+
+def calculate_monthly_breakdown(df: pd.DataFrame, grouped_data: pd.DataFrame = None) -> List[Dict]:
     """
     Calculate monthly breakdown of transactions using pandas.
+    A precomputed grouped_data frame from _compute_grouped can be passed to skip regrouping.
     """
     if df.empty:
         print("[WARNING] Empty DataFrame provided for monthly breakdown")
@@ -237,38 +341,57 @@ def calculate_monthly_breakdown(df: pd.DataFrame) -> List[Dict]:
         
     try:
         # Group data by month, category type, and subcategory
-        grouped_data = df.groupby(['month', 'category_type', 'sub_category']).agg({
-            'debit': 'sum',
-            'credit': 'sum'
-        }).reset_index()
+        if grouped_data is None:
+            grouped_data = _compute_grouped(df)
         
         monthly_breakdown = []
         
+        # Round all breakdown amounts in one vectorized call instead of per entry
+        grouped_data = grouped_data.assign(
+            debit_rounded=grouped_data['debit'].round(2),
+            credit_rounded=grouped_data['credit'].round(2)
+        )
+        
+        # Evaluate the category masks once and partition each side by month in a single pass
+        income_mask = grouped_data['category_type'] == 'income'
+        expense_mask = grouped_data['category_type'] == 'expense'
+        income_by_month = dict(iter(grouped_data[income_mask].groupby('month', sort=False, observed=True)))
+        expense_by_month = dict(iter(grouped_data[expense_mask].groupby('month', sort=False, observed=True)))
+        no_rows = grouped_data.iloc[0:0]
+        
         # Process each month
         for month in sorted(df['month'].unique()):
-            month_data = grouped_data[grouped_data['month'] == month]
-            
             # Get income and expense data
-            income_data = month_data[month_data['category_type'] == 'income']
-            expense_data = month_data[month_data['category_type'] == 'expense']
+            income_data = income_by_month.get(month, no_rows)
+            expense_data = expense_by_month.get(month, no_rows)
             
             # Calculate totals
             income_amount = round(float(income_data['credit'].sum()), 2)
             expense_amount = round(float(expense_data['debit'].sum()), 2)
             savings = round(income_amount - expense_amount, 2)
             
-            # Create category breakdowns
-            income_breakdown = [
-                {row['sub_category']: round(float(row['credit']), 2)}
-                for _, row in income_data.iterrows()
-                if row['credit'] > 0
-            ]
+            # Create category breakdowns as (sub_category, amount) pairs sorted by name
+            income_items = sorted(
+                ((sub_category, rounded)
+                 for sub_category, credit, rounded in zip(
+                     income_data['sub_category'].tolist(),
+                     income_data['credit'].tolist(),
+                     income_data['credit_rounded'].tolist()
+                 )
+                 if credit > 0),
+                key=itemgetter(0)
+            )
             
-            expense_breakdown = [
-                {row['sub_category']: round(float(row['debit']), 2)}
-                for _, row in expense_data.iterrows()
-                if row['debit'] > 0
-            ]
+            expense_items = sorted(
+                ((sub_category, rounded)
+                 for sub_category, debit, rounded in zip(
+                     expense_data['sub_category'].tolist(),
+                     expense_data['debit'].tolist(),
+                     expense_data['debit_rounded'].tolist()
+                 )
+                 if debit > 0),
+                key=itemgetter(0)
+            )
             
             # Create month entry
             month_entry = {
@@ -276,8 +399,8 @@ def calculate_monthly_breakdown(df: pd.DataFrame) -> List[Dict]:
                 "income": income_amount,
                 "expense": expense_amount,
                 "savings": savings,
-                "income_breakdown": sorted(income_breakdown, key=lambda x: list(x.keys())[0]),
-                "expense_breakdown": sorted(expense_breakdown, key=lambda x: list(x.keys())[0])
+                "income_breakdown": [{name: amount} for name, amount in income_items],
+                "expense_breakdown": [{name: amount} for name, amount in expense_items]
             }
             
             monthly_breakdown.append(month_entry)
@@ -291,23 +414,43 @@ def flatten_breakdown(monthly_data: List[Dict], key: str) -> pd.DataFrame:
     """
     Flatten category breakdowns into a DataFrame for median calculations.
     """
-    rows = []
     try:
-        for entry in monthly_data:
-            month = entry["month"]
-            for cat in entry.get(key, []):
-                for k, v in cat.items():
-                    rows.append({"month": month, "category": k, "amount": v})
-        return pd.DataFrame(rows)
+        # Build the frame from flat tuples in one constructor call
+        records = (
+            (entry["month"], k, v)
+            for entry in monthly_data
+            for cat in entry.get(key, [])
+            for k, v in cat.items()
+        )
+        return pd.DataFrame.from_records(records, columns=["month", "category", "amount"])
     except Exception as e:
         print(f"[ERROR] flatten_breakdown: {e}")
         return pd.DataFrame()
 
-def calculate_median_summary(monthly_breakdown: List[Dict]) -> Dict:
+def calculate_median_summary(monthly_breakdown: List[Dict], grouped_data: pd.DataFrame = None) -> Dict:
     """
     Calculate median values across all months.
+    When grouped_data is given, category medians are taken from it directly
+    instead of re-flattening the breakdown dicts.
     """
     try:
+        # With fewer than two months the median is just the single month (or nothing)
+        if len(monthly_breakdown) <= 1:
+            month = monthly_breakdown[0] if monthly_breakdown else {}
+            return {
+                "median_income": round(float(month.get("income", 0.0)), 2),
+                "median_expense": round(float(month.get("expense", 0.0)), 2),
+                "median_savings": round(float(month.get("savings", 0.0)), 2),
+                "median_income_breakdown": {
+                    k: round(float(v), 2)
+                    for cat in month.get("income_breakdown", []) for k, v in cat.items()
+                },
+                "median_expense_breakdown": {
+                    k: round(float(v), 2)
+                    for cat in month.get("expense_breakdown", []) for k, v in cat.items()
+                }
+            }
+        
         # Convert main metrics to DataFrame
         df_metrics = pd.DataFrame(monthly_breakdown)
         
@@ -317,17 +460,22 @@ def calculate_median_summary(monthly_breakdown: List[Dict]) -> Dict:
         median_savings = df_metrics['savings'].median()
         
         # Flatten and calculate medians for breakdowns
-        df_income = flatten_breakdown(monthly_breakdown, "income_breakdown")
-        df_expense = flatten_breakdown(monthly_breakdown, "expense_breakdown")
+        if grouped_data is not None:
+            # Breakdown entries are rounded before the median is taken
+            df_income = _category_amounts(grouped_data, 'income', 'credit').round({'amount': 2})
+            df_expense = _category_amounts(grouped_data, 'expense', 'debit').round({'amount': 2})
+        else:
+            df_income = flatten_breakdown(monthly_breakdown, "income_breakdown")
+            df_expense = flatten_breakdown(monthly_breakdown, "expense_breakdown")
         
         # Calculate category medians
         median_income_cats = (
-            df_income.groupby("category")["amount"].median().to_dict()
+            df_income.groupby("category", observed=True)["amount"].median().to_dict()
             if not df_income.empty else {}
         )
         
         median_expense_cats = (
-            df_expense.groupby("category")["amount"].median().to_dict()
+            df_expense.groupby("category", observed=True)["amount"].median().to_dict()
             if not df_expense.empty else {}
         )
         
@@ -348,7 +496,7 @@ def calculate_median_summary(monthly_breakdown: List[Dict]) -> Dict:
         print(f"[ERROR] calculate_median_summary: {e}")
         return {}
 
-def generate_transaction_breakdown(response_data: Dict[str, Any]) -> Dict:
+def generate_transaction_breakdown(response_data: Union[Dict[str, Any], List[Dict], Iterator[Dict], pd.DataFrame]) -> Dict:
     """
     Generate complete transaction analysis including monthly breakdown and median summary.
     """
@@ -357,11 +505,14 @@ def generate_transaction_breakdown(response_data: Dict[str, Any]) -> Dict:
         # Prepare DataFrame
         df = prepare_transaction_dataframe(response_data)
         
+        # Group once and derive both the monthly breakdown and the medians from it
+        grouped_data = _compute_grouped(df) if not df.empty else None
+        
         # Calculate monthly breakdown
-        monthly_breakdown = calculate_monthly_breakdown(df)
+        monthly_breakdown = calculate_monthly_breakdown(df, grouped_data)
         
         # Calculate median summary
-        median_summary = calculate_median_summary(monthly_breakdown)
+        median_summary = calculate_median_summary(monthly_breakdown, grouped_data)
         
         return {
             "monthly_breakdown": monthly_breakdown,
@@ -4,28 +4,38 @@ from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from bank_statement_service import process_bank_statement
 from typing import Dict, Optional
 import os
-import tempfile
 from dotenv import load_dotenv
 import json
 import uuid
+import gzip
 import time
 import logging
-from collections import defaultdict
-from fastapi.responses import StreamingResponse
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from collections import defaultdict, deque
+from fastapi.responses import StreamingResponse, Response, ORJSONResponse
+import orjson
 import asyncio
 from progress_manager import progress_manager
+from gpt_client import openai_client
 
 
 log_dir = 'D:\\tmp'
 os.makedirs(log_dir, exist_ok=True)
 
 
-# Configure logging
+# Configure logging; records are queued and written to the file by a background thread,
+# so request handlers never block on log file I/O
+log_queue = queue.Queue(-1)
+log_file_handler = logging.FileHandler('/tmp/app.log')
+log_file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+log_listener = QueueListener(log_queue, log_file_handler)
 logging.basicConfig(
-    filename='/tmp/app.log',
     level=logging.INFO,
-    format='%(asctime)s %(levelname)s %(message)s',
+    format='%(message)s',  # The file handler adds the timestamp and level
+    handlers=[QueueHandler(log_queue)],
 )
+log_listener.start()
 logger = logging.getLogger(__name__)
 
 # Import custom modules
@@ -34,12 +44,12 @@ from pdf_service import check_pdf_password_protection, process_pdf_file, PDFPass
 
 # Load environment variables
 load_dotenv()
-status_cache = {}
 # Initialize FastAPI app
 app = FastAPI(
     title="Bank Statement Analyzer",
     description="API for analyzing bank statements using AWS Textract and GPT",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -57,24 +67,40 @@ app.add_middleware(
     allowed_hosts=["*"]  # Configure appropriately for production
 )
 
-# Simple rate limiting
-request_counts = defaultdict(list)
+# Simple rate limiting: timestamps of the requests inside the window, oldest first
 RATE_LIMIT_WINDOW = 60  # 1 minute
 RATE_LIMIT_MAX_REQUESTS = 10  # 10 requests per minute
+RATE_LIMIT_MAX_TRACKED_IPS = 10000
+request_counts = defaultdict(lambda: deque(maxlen=RATE_LIMIT_MAX_REQUESTS))
+last_rate_limit_sweep = 0.0  # when idle clients were last forgotten
+
+# Uploaded statements
+MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+UPLOAD_READ_CHUNK_SIZE = 64 * 1024
+FILE_TOO_LARGE_DETAIL = f"File size too large. Maximum allowed size is {MAX_FILE_SIZE // (1024 * 1024)}MB"
 
 def check_rate_limit(client_ip: str) -> bool:
     """Check if client has exceeded rate limit"""
+    global last_rate_limit_sweep
     current_time = time.time()
-    # Remove old requests outside the window
-    request_counts[client_ip] = [req_time for req_time in request_counts[client_ip] 
-                                if current_time - req_time < RATE_LIMIT_WINDOW]
+    window = request_counts[client_ip]
+    # Drop old requests outside the window from the front only
+    while window and current_time - window[0] >= RATE_LIMIT_WINDOW:
+        window.popleft()
     
     # Check if limit exceeded
-    if len(request_counts[client_ip]) >= RATE_LIMIT_MAX_REQUESTS:
+    if len(window) >= RATE_LIMIT_MAX_REQUESTS:
         return False
     
     # Add current request
-    request_counts[client_ip].append(current_time)
+    window.append(current_time)
+    
+    # Forget idle clients once the table gets large so it does not grow with every IP ever seen;
+    # at most one sweep per window, since a full table of active clients has nothing to forget
+    if len(request_counts) > RATE_LIMIT_MAX_TRACKED_IPS and current_time - last_rate_limit_sweep >= RATE_LIMIT_WINDOW:
+        last_rate_limit_sweep = current_time
+        for ip in [ip for ip, times in request_counts.items() if current_time - times[-1] >= RATE_LIMIT_WINDOW]:
+            del request_counts[ip]
     return True
 
 # Valkey Glide client
@@ -138,59 +164,93 @@ def check_rate_limit(client_ip: str) -> bool:
 #         except Exception as e:
 #             logger.error(f"Error closing Valkey client: {e}")
 
+# Open the shared OpenAI HTTP pool on startup so the first statement does not pay for DNS and TLS
+@app.on_event("startup")
+async def warm_openai_client():
+    """Establish a pooled OpenAI connection with one cheap request"""
+    if os.getenv('OPENAI_WARMUP', 'true').lower() != 'true':
+        return
+    try:
+        await openai_client.with_options(timeout=5.0, max_retries=0).models.retrieve('gpt-4.1-nano')
+        logger.info("OpenAI client connection warmed up")
+    except Exception as e:
+        logger.warning(f"OpenAI client warm-up failed: {e}")
+
+# Close the shared OpenAI HTTP pool on shutdown
+@app.on_event("shutdown")
+async def close_openai_client():
+    """Release pooled OpenAI connections on application shutdown"""
+    try:
+        await openai_client.close()
+        logger.info("OpenAI client connections closed")
+    except Exception as e:
+        logger.error(f"Error closing OpenAI client: {e}")
+
+# Flush queued log records before exit
+@app.on_event("shutdown")
+def stop_log_listener():
+    """Write out pending log records and stop the logging thread"""
+    log_listener.stop()
+
+# Home endpoint payload is static, so serialize it once at import time
+HOME_PAYLOAD = {
+    "status": "success",
+    "data": {
+        "api_status": "online",
+        "message": "Welcome to Bank Statement Analyzer API",
+        "endpoints": {
+            "home": "GET /",
+            "health": "GET /health",
+            "analyze_statement": "POST /analyze-bank-statement",
+            "check_status": "GET /check-bs-status/{task_id}",
+            "docs": "GET /docs",
+            "redoc": "GET /redoc"
+        }
+    }
+}
+HOME_RESPONSE_BODY = orjson.dumps(HOME_PAYLOAD)
+
 # Home endpoint
 @app.get("/")
-async def home() -> Dict:
+async def home() -> Response:
     """
     Root endpoint that provides API information and available endpoints.
     """
-    return {
-        "status": "success",
-        "data": {
-            "api_status": "online",
-            "message": "Welcome to Bank Statement Analyzer API",
-            "endpoints": {
-                "home": "GET /",
-                "health": "GET /health",
-                "analyze_statement": "POST /analyze-bank-statement",
-                "check_status": "GET /check-bs-status/{task_id}",
-                "docs": "GET /docs",
-                "redoc": "GET /redoc"
-            }
-        }
-    }
+    return Response(content=HOME_RESPONSE_BODY, media_type="application/json")
+
+# Health check endpoint. Liveness probes hit this every second or so, so it only inspects
+# in-process state; the healthy payload is kept in one dict and probes that send back the
+# ETag get an empty 304
+HEALTHY_ETAG = '"healthy-v1"'
+HEALTHY_PAYLOAD = {
+    "status": "healthy",
+    "message": "All services are operational",
+    "timestamp": 0.0,
+    "services": {"openai": "connected", "background_tasks": "available"}
+}
+UNHEALTHY_SERVICES = {"openai": "closed", "background_tasks": "unknown"}
 
-# Health check endpoint
 @app.get("/health")
-async def health_check() -> Dict:
+async def health_check(request: Request):
     """
     Health check endpoint for monitoring.
     """
-    try:
-        # Check Valkey connection
-        client = await get_valkey_client()
-        await client.ping()
-        
-        return {
-            "status": "healthy",
-            "message": "All services are operational",
-            "timestamp": time.time(),
-            "services": {
-                "valkey": "connected",
-                "celery": "available"
-            }
-        }
-    except Exception as e:
-        logger.error(f"Health check failed: {e}")
+    if openai_client.is_closed():
+        logger.error("Health check failed: OpenAI client is closed")
         return {
             "status": "unhealthy",
-            "message": f"Service check failed: {str(e)}",
+            "message": "Service check failed: OpenAI client is closed",
             "timestamp": time.time(),
-            "services": {
-                "valkey": "disconnected",
-                "celery": "unknown"
-            }
+            "services": UNHEALTHY_SERVICES
         }
+    if request.headers.get("if-none-match") == HEALTHY_ETAG:
+        return Response(status_code=304, headers={"ETag": HEALTHY_ETAG})
+    HEALTHY_PAYLOAD["timestamp"] = time.time()
+    return Response(
+        content=orjson.dumps(HEALTHY_PAYLOAD),
+        media_type="application/json",
+        headers={"ETag": HEALTHY_ETAG}
+    )
 
 # Analyze statement endpoint
 # @app.post("/analyze-bank-statement")
@@ -479,18 +539,18 @@ async def process_statement(background_tasks: BackgroundTasks, file: UploadFile
     """
     Background processing with progress streaming.
     """
+    # The upload is read into memory once and handed to the task as is; nothing touches disk.
+    # Reading it in chunks stops an oversized file before all of it is buffered.
+    buffer = bytearray()
+    while chunk := await file.read(UPLOAD_READ_CHUNK_SIZE):
+        buffer.extend(chunk)
+        if len(buffer) > MAX_FILE_SIZE:
+            raise HTTPException(status_code=413, detail=FILE_TOO_LARGE_DETAIL)
+    file_bytes = bytes(buffer)
+
     task_id = str(uuid.uuid4())
     progress_manager.init_task(task_id)
-
-    suffix = os.path.splitext(file.filename)[1]
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
-        temp_file.write(await file.read())
-        temp_path = temp_file.name
-
-    with open(temp_path, 'rb') as f:
-        file_bytes = f.read()
-
-    background_tasks.add_task(background_process, file_bytes, task_id, temp_path)
+    background_tasks.add_task(background_process, file_bytes, task_id)
 
     return {"task_id": task_id, "message": f"Processing started. Listen on /progress-stream/{task_id}"}
 
@@ -510,20 +570,28 @@ async def process_statement(background_tasks: BackgroundTasks, file: UploadFile
 #         os.remove(temp_path)
 
 
-async def background_process(file_bytes: bytes, task_id: str, temp_path: str):
+async def background_process(file_bytes: bytes, task_id: str):
     try:
         result = await process_bank_statement(file_bytes, task_id=task_id)
-        status_cache[task_id] = result
-
-        # Final progress update WITH COMPLETE RESULT
+    except Exception as e:
+        logger.error(f"Processing failed for task {task_id}: {e}")
+        # Terminal event: ends the SSE stream and lets the task be pruned
         await progress_manager.update_progress(
             task_id,
             progress=100,
-            message="Processing complete!",
-            data=result  # <-- This is your full result
+            message="Processing failed",
+            data={"error": str(e)}
         )
-    finally:
-        os.remove(temp_path)
+        return
+    progress_manager.set_result(task_id, result)
+
+    # Final progress update only points at the result so SSE events stay small
+    await progress_manager.update_progress(
+        task_id,
+        progress=100,
+        message="Processing complete!",
+        data={"result_url": f"/api/result/{task_id}"}
+    )
 
 # @app.get("/progress-stream/{task_id}")
 # async def progress_stream(task_id: str):
@@ -533,6 +601,25 @@ async def background_process(file_bytes: bytes, task_id: str, temp_path: str):
 async def progress_stream(task_id: str):
     return StreamingResponse(progress_manager.listen(task_id), media_type="text/event-stream")
 
+@app.get("/api/result/{task_id}")
+async def get_result(task_id: str, request: Request):
+    """
+    Full result of a completed statement, linked from the final progress event.
+    The stored gzip body is sent as is to clients that accept it.
+    """
+    result = progress_manager.get_result(task_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Result not found or processing not complete")
+    
+    body, gzipped = result
+    headers = {"Vary": "Accept-Encoding"}
+    if gzipped:
+        if "gzip" in request.headers.get("accept-encoding", ""):
+            headers["Content-Encoding"] = "gzip"
+        else:
+            body = gzip.decompress(body)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 # Run the app
 if __name__ == '__main__':
     import uvicorn
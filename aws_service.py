@@ -1,10 +1,19 @@
 import boto3
 import os
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from fastapi import UploadFile
-from io import BytesIO
+from io import BytesIO, SEEK_END
+import asyncio
+import hashlib
+import orjson
 import time
+import uuid
+from collections import OrderedDict
+from typing import List, Optional, Tuple
 from exceptions import S3UploadError, TextractError
+from pdf_service import get_pdf_page_count
 from io import BytesIO
 from dotenv import load_dotenv
 
@@ -16,6 +25,13 @@ AWS_BUCKET_NAME = os.getenv('AWS_BUCKET_NAME')
 AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
 
+# Textract polling backoff (seconds)
+TEXTRACT_POLL_BASE = float(os.getenv('TEXTRACT_POLL_BASE', 1))
+TEXTRACT_POLL_CAP = float(os.getenv('TEXTRACT_POLL_CAP', 10))
+TEXTRACT_PAGE_SIZE = 1000  # Largest page GetDocumentAnalysis returns, fewest round trips
+# Single-page PDFs up to this size go to synchronous AnalyzeDocument, skipping S3 and polling
+TEXTRACT_SYNC_MAX_BYTES = 5 * 1024 * 1024
+
 # Validate required AWS configuration
 if not AWS_BUCKET_NAME:
     raise ValueError("AWS_BUCKET_NAME environment variable is required")
@@ -24,12 +40,30 @@ if not AWS_ACCESS_KEY_ID:
 if not AWS_SECRET_ACCESS_KEY:
     raise ValueError("AWS_SECRET_ACCESS_KEY environment variable is required")
 
+# Textract result cache keyed by SHA-256 of the PDF bytes
+TEXTRACT_CACHE_TTL = int(os.getenv('TEXTRACT_CACHE_TTL', 7 * 86400))  # seconds
+TEXTRACT_CACHE_MAX_ENTRIES = int(os.getenv('TEXTRACT_CACHE_MAX_ENTRIES', 128))
+# Also persist results under textract-cache/ in the bucket so they survive restarts
+TEXTRACT_CACHE_S3 = os.getenv('TEXTRACT_CACHE_S3', 'false').lower() == 'true'
+TEXTRACT_CACHE_PREFIX = 'textract-cache/'
+
+# Shared client configuration: a larger connection pool for concurrent requests,
+# TCP keep-alive so pooled connections stay warm, and adaptive retries
+AWS_MAX_POOL_CONNECTIONS = int(os.getenv('AWS_MAX_POOL_CONNECTIONS', 50))
+AWS_MAX_ATTEMPTS = int(os.getenv('AWS_MAX_ATTEMPTS', 8))  # Textract throttles bursts of polls
+aws_client_config = Config(
+    max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+    retries={"max_attempts": AWS_MAX_ATTEMPTS, "mode": "adaptive"},
+    tcp_keepalive=True
+)
+
 # Initialize S3 client
 s3_client = boto3.client(
     's3',
     aws_access_key_id=AWS_ACCESS_KEY_ID,
     aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
+    region_name=AWS_REGION,
+    config=aws_client_config
 )
 
 # Initialize Textract client
@@ -37,15 +71,23 @@ textract_client = boto3.client(
     'textract',
     aws_access_key_id=AWS_ACCESS_KEY_ID,
     aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
+    region_name=AWS_REGION,
+    config=aws_client_config
 )
 
-async def upload_fileobj_to_s3(file: UploadFile | BytesIO, bucket_name: str, s3_key: str) -> str:
+# Multipart settings for uploads: PDFs above the threshold are sent as parts in parallel
+S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=10
+)
+
+async def upload_fileobj_to_s3(file: UploadFile | BytesIO | bytes, bucket_name: str, s3_key: str) -> str:
     """
     Upload a file object directly to S3 bucket
     
     Args:
-        file (UploadFile | BytesIO): File object to upload
+        file (UploadFile | BytesIO | bytes): File object, or the file's bytes, to upload
         bucket_name (str): S3 bucket name
         s3_key (str): S3 object key
     
@@ -58,17 +100,49 @@ async def upload_fileobj_to_s3(file: UploadFile | BytesIO, bucket_name: str, s3_
     try:
         if isinstance(file, UploadFile):
             await file.seek(0)  # Reset file pointer to beginning
-            s3_client.upload_fileobj(file.file, bucket_name, s3_key)
+            fileobj = file.file
+            size = file.size
+        elif isinstance(file, (bytes, bytearray)):
+            fileobj = BytesIO(file)
+            size = len(file)
         else:  # BytesIO
+            size = file.seek(0, SEEK_END)
             file.seek(0)  # Reset file pointer to beginning
-            s3_client.upload_fileobj(file, bucket_name, s3_key)
+            fileobj = file
+        
+        if size is not None and size < S3_TRANSFER_CONFIG.multipart_threshold:
+            # Small files go up in a single PUT without the transfer manager's threads
+            await asyncio.to_thread(
+                s3_client.put_object, Bucket=bucket_name, Key=s3_key, Body=fileobj, ContentLength=size
+            )
+        else:
+            await asyncio.to_thread(s3_client.upload_fileobj, fileobj, bucket_name, s3_key, Config=S3_TRANSFER_CONFIG)
         return f"s3://{bucket_name}/{s3_key}"
     except ClientError as e:
         raise S3UploadError(f"Failed to upload file to S3: {str(e)}")
     except Exception as e:
         raise S3UploadError(f"Unexpected error during S3 upload: {str(e)}")
 
-def process_textract_job(job_id: str) -> dict:
+async def upload_fileobjs_to_s3(files: List[Tuple[UploadFile | BytesIO | bytes, str]], bucket_name: str) -> List[str]:
+    """
+    Upload several file objects to S3 concurrently
+    
+    Args:
+        files (List[Tuple[UploadFile | BytesIO | bytes, str]]): (file object, S3 key) pairs to upload
+        bucket_name (str): S3 bucket name
+    
+    Returns:
+        List[str]: S3 URIs of the uploaded files, in the order given
+    
+    Raises:
+        S3UploadError: If any upload fails
+    """
+    # Each upload runs in its own worker thread; the shared client is thread-safe
+    return await asyncio.gather(
+        *[upload_fileobj_to_s3(file, bucket_name, s3_key) for file, s3_key in files]
+    )
+
+async def process_textract_job(job_id: str) -> List[List[List[str]]]:
     """
     Process Textract job and extract table data
     
@@ -76,103 +150,234 @@ def process_textract_job(job_id: str) -> dict:
         job_id (str): Textract job ID
     
     Returns:
-        Dict: Dictionary containing extracted table data
+        List[List[List[str]]]: Rows of cell text for each table, in document order
     
     Raises:
         TextractError: If job processing fails
     """
+    # Poll with exponential backoff without blocking the event loop
+    attempt = 0
     while True:
-        result = textract_client.get_document_analysis(JobId=job_id)
+        result = await asyncio.to_thread(
+            textract_client.get_document_analysis, JobId=job_id, MaxResults=TEXTRACT_PAGE_SIZE
+        )
         status = result['JobStatus']
         if status in ['SUCCEEDED', 'FAILED']:
             break
-        time.sleep(5)
+        await asyncio.sleep(min(TEXTRACT_POLL_CAP, TEXTRACT_POLL_BASE * 2 ** attempt))
+        attempt += 1
 
     if status == 'FAILED':
         raise TextractError("Textract job failed")
 
-    next_token = None
-    all_blocks = []
-    table_data_dict = {}
-
-    # Collect all blocks from the job
-    while True:
-        if next_token:
-            result = textract_client.get_document_analysis(JobId=job_id, NextToken=next_token)
-        else:
-            result = textract_client.get_document_analysis(JobId=job_id)
-        all_blocks.extend(result['Blocks'])
+    # The final status poll already carries the first page of blocks. Each NextToken
+    # only comes with the previous page, so the remaining pages are fetched in order.
+    # Pages are partitioned as they arrive, keeping only table, cell and word data
+    tables, cells, words = [], {}, {}
+    partition_blocks(result['Blocks'], tables, cells, words)
+    next_token = result.get('NextToken')
+    while next_token:
+        result = await asyncio.to_thread(
+            textract_client.get_document_analysis, JobId=job_id, MaxResults=TEXTRACT_PAGE_SIZE, NextToken=next_token
+        )
+        partition_blocks(result['Blocks'], tables, cells, words)
         next_token = result.get('NextToken')
-        if not next_token:
-            break
 
-    # Process blocks into tables
-    block_map = {b['Id']: b for b in all_blocks}
-    tables = [b for b in all_blocks if b['BlockType'] == 'TABLE']
+    return assemble_tables(tables, cells, words)
 
-    for table_index, table in enumerate(tables, 1):
-        table_key = f"Table {table_index}"
-        table_rows = []
-        rows = {}
-        
-        for rel in table.get('Relationships', []):
-            if rel['Type'] == 'CHILD':
-                for cell_id in rel['Ids']:
-                    cell = block_map[cell_id]
-                    row_idx = cell['RowIndex']
-                    col_idx = cell['ColumnIndex']
-                    text = ''
-                    if 'Relationships' in cell:
-                        for cr in cell['Relationships']:
-                            if cr['Type'] == 'CHILD':
-                                text += ' '.join(block_map[word_id]['Text'] for word_id in cr['Ids'])
-                    rows.setdefault(row_idx, {})[col_idx] = text
-        
-        for r in sorted(rows.keys()):
-            row_data = [rows[r].get(c, '') for c in sorted(rows[r].keys())]
-            table_rows.append(row_data)
-        
-        table_data_dict[table_key] = table_rows
+def build_tables_from_blocks(blocks: List[dict]) -> List[List[List[str]]]:
+    """
+    Rebuild table rows from Textract blocks
+    
+    Args:
+        blocks (List[dict]): All blocks returned for a document analysis job
+    
+    Returns:
+        List[List[List[str]]]: Rows of cell text for each table, in document order
+    """
+    tables, cells, words = [], {}, {}
+    partition_blocks(blocks, tables, cells, words)
+    return assemble_tables(tables, cells, words)
 
-    return table_data_dict
+def partition_blocks(blocks: List[dict], tables: List[dict], cells: dict, words: dict) -> None:
+    """
+    Sort one page of Textract blocks into the collections needed to rebuild tables
+    
+    Args:
+        blocks (List[dict]): Blocks of a document analysis page
+        tables (List[dict]): TABLE blocks in document order, appended to
+        cells (dict): CELL blocks by Id, updated
+        words (dict): WORD text by Id, updated
+    """
+    for block in blocks:
+        block_type = block['BlockType']
+        if block_type == 'WORD':
+            words[block['Id']] = block['Text']
+        elif block_type == 'CELL':
+            cells[block['Id']] = block
+        elif block_type == 'TABLE':
+            tables.append(block)
 
-async def extract_tables_from_pdf(file: UploadFile | BytesIO) -> dict:
+def assemble_tables(tables: List[dict], cells: dict, words: dict) -> List[List[List[str]]]:
+    """
+    Place cell text into the rows of each table
+    
+    Args:
+        tables (List[dict]): TABLE blocks in document order
+        cells (dict): CELL blocks by Id
+        words (dict): WORD text by Id
+    
+    Returns:
+        List[List[List[str]]]: Rows of cell text for each table, in document order
+    """
+    table_data = []
+    for table in tables:
+        table_cells = [
+            cells[cell_id]
+            for rel in table.get('Relationships', []) if rel['Type'] == 'CHILD'
+            for cell_id in rel['Ids'] if cell_id in cells
+        ]
+        if not table_cells:
+            table_data.append([])
+            continue
+
+        # Size the grid from the largest indices so cells are placed by index instead of sorted
+        max_row = max(cell['RowIndex'] for cell in table_cells)
+        max_col = max(cell['ColumnIndex'] for cell in table_cells)
+        grid = [[''] * max_col for _ in range(max_row)]
+        filled_rows = [False] * max_row
+
+        for cell in table_cells:
+            word_text = [
+                words[word_id]
+                for rel in cell.get('Relationships', []) if rel['Type'] == 'CHILD'
+                for word_id in rel['Ids'] if word_id in words
+            ]
+            grid[cell['RowIndex'] - 1][cell['ColumnIndex'] - 1] = ' '.join(word_text)
+            filled_rows[cell['RowIndex'] - 1] = True
+
+        table_data.append([row for row, filled in zip(grid, filled_rows) if filled])
+
+    return table_data
+
+# digest -> (stored_at, table_data), oldest first
+textract_cache = OrderedDict()
+
+async def get_cached_tables(digest: str) -> Optional[List[List[List[str]]]]:
+    """
+    Look up Textract table data for a file digest
+    
+    Args:
+        digest (str): SHA-256 hex digest of the PDF bytes
+    
+    Returns:
+        Optional[List[List[List[str]]]]: Cached table data, or None on a miss
+    """
+    entry = textract_cache.get(digest)
+    if entry:
+        stored_at, table_data = entry
+        if time.time() - stored_at < TEXTRACT_CACHE_TTL:
+            textract_cache.move_to_end(digest)
+            return table_data
+        del textract_cache[digest]
+
+    if TEXTRACT_CACHE_S3:
+        try:
+            result = await asyncio.to_thread(
+                s3_client.get_object, Bucket=AWS_BUCKET_NAME, Key=f"{TEXTRACT_CACHE_PREFIX}{digest}.json"
+            )
+            if time.time() - result['LastModified'].timestamp() < TEXTRACT_CACHE_TTL:
+                table_data = orjson.loads(result['Body'].read())
+                _remember_tables(digest, table_data)
+                return table_data
+        except ClientError:
+            pass
+        except Exception as e:
+            print(f"   - Warning: Failed to read Textract cache: {str(e)}")
+    return None
+
+async def cache_tables(digest: str, table_data: List[List[List[str]]]) -> None:
+    """
+    Store Textract table data for a file digest
+    
+    Args:
+        digest (str): SHA-256 hex digest of the PDF bytes
+        table_data (List[List[List[str]]]): Extracted table data
+    """
+    _remember_tables(digest, table_data)
+    if TEXTRACT_CACHE_S3:
+        try:
+            await asyncio.to_thread(
+                s3_client.put_object,
+                Bucket=AWS_BUCKET_NAME,
+                Key=f"{TEXTRACT_CACHE_PREFIX}{digest}.json",
+                Body=orjson.dumps(table_data),
+                ContentType='application/json'
+            )
+        except Exception as e:
+            print(f"   - Warning: Failed to write Textract cache: {str(e)}")
+
+def _remember_tables(digest: str, table_data: List[List[List[str]]]) -> None:
+    """Keep table data in the in-process cache, evicting the least recently used entries."""
+    textract_cache[digest] = (time.time(), table_data)
+    textract_cache.move_to_end(digest)
+    while len(textract_cache) > TEXTRACT_CACHE_MAX_ENTRIES:
+        textract_cache.popitem(last=False)
+
+async def extract_tables_from_pdf(file: UploadFile | BytesIO | bytes) -> List[List[List[str]]]:
     """
     Extract tables from PDF using Amazon Textract
     
     Args:
-        file (UploadFile | BytesIO): File object containing the PDF
+        file (UploadFile | BytesIO | bytes): File object, or the bytes, of the PDF
     
     Returns:
-        Dict: Dictionary containing extracted table data
+        List[List[List[str]]]: Rows of cell text for each table, in document order
     """
     s3_key = None
     try:
-        # Get filename from UploadFile or use a default name for BytesIO
-        filename = file.filename if isinstance(file, UploadFile) else "statement.pdf"
+        # Read the PDF once; the same bytes feed the cache digest and the upload
+        if isinstance(file, UploadFile):
+            await file.seek(0)
+            data = await file.read()
+        elif isinstance(file, BytesIO):
+            data = file.getvalue()
+        else:
+            data = file
+        
+        # Skip Textract entirely for a file that was already extracted
+        digest = hashlib.sha256(data).hexdigest()
+        cached = await get_cached_tables(digest)
+        if cached is not None:
+            print("   - Using cached Textract results")
+            return cached
         
-        # Upload file to S3
-        s3_key = f"uploads/{filename}"
+        if len(data) <= TEXTRACT_SYNC_MAX_BYTES and get_pdf_page_count(data) == 1:
+            print("   - Running synchronous Textract analysis...")
+            response = await asyncio.to_thread(
+                textract_client.analyze_document, Document={'Bytes': data}, FeatureTypes=['TABLES']
+            )
+            table_data = build_tables_from_blocks(response['Blocks'])
+            await cache_tables(digest, table_data)
+            return table_data
+        
+        # Upload file to S3 under a per-request key so concurrent statements do not overwrite each other
+        s3_key = f"uploads/{uuid.uuid4().hex}.pdf"
         print("   - Starting Textract job...")
-        buffer = BytesIO(file)
-        await upload_fileobj_to_s3(buffer, AWS_BUCKET_NAME, s3_key)
+        await upload_fileobj_to_s3(data, AWS_BUCKET_NAME, s3_key)
         
         # Start Textract job
-        response = textract_client.start_document_analysis(
+        response = await asyncio.to_thread(
+            textract_client.start_document_analysis,
             DocumentLocation={ 'S3Object': { 'Bucket': AWS_BUCKET_NAME, 'Name': s3_key } },
             FeatureTypes=['TABLES']
         )
         
         # Process the job
         print("   - Processing Textract results...")
-        table_data = process_textract_job(response['JobId'])
-        
-        # Clean up S3
-        try:
-            s3_client.delete_object(Bucket=AWS_BUCKET_NAME, Key=s3_key)
-        except Exception as e:
-            print(f"   - Warning: Failed to delete S3 object: {str(e)}")
+        table_data = await process_textract_job(response['JobId'])
         
+        await cache_tables(digest, table_data)
         return table_data
 
     except (S3UploadError, TextractError) as e:
@@ -180,9 +385,9 @@ async def extract_tables_from_pdf(file: UploadFile | BytesIO) -> dict:
     except Exception as e:
         raise Exception(f"Failed to extract tables from PDF: {str(e)}")
     finally:
-        # Clean up S3 in case of any errors
+        # Clean up S3 once, whether the job succeeded or not
         if s3_key:
             try:
-                s3_client.delete_object(Bucket=AWS_BUCKET_NAME, Key=s3_key)
-            except:
-                pass
+                await asyncio.to_thread(s3_client.delete_object, Bucket=AWS_BUCKET_NAME, Key=s3_key)
+            except Exception as e:
+                print(f"   - Warning: Failed to delete S3 object: {str(e)}")
@@ -1,8 +1,7 @@
 # from aws_service import extract_tables_from_pdf
-from gpt_service import analyze_table_structure, extract_transactions, categorize_transactions
+from gpt_service import PartialResult, analyze_table_structure, extract_transactions, categorize_transactions
 from aws_service import extract_tables_from_pdf
-from analysis import generate_transaction_breakdown, calculate_median_summary, calculate_monthly_breakdown,calculate_monthly_summary
-import pandas as pd
+from analysis import generate_transaction_breakdown
 # from analysis import generate_transaction_breakdown
 
 # async def process_bank_statement(file_bytes: bytes) -> dict:
@@ -34,6 +33,47 @@ import pandas as pd
 
 from io import BytesIO
 from progress_manager import progress_manager
+from collections import OrderedDict
+import asyncio
+from hashlib import blake2b
+import orjson
+import os
+import time
+
+# GPT stage results keyed on a hash of their inputs, so a re-uploaded or retried
+# statement resumes at the first stage whose inputs changed
+GPT_CACHE_TTL = int(os.getenv('GPT_CACHE_TTL', 30 * 86400))  # seconds
+GPT_CACHE_MAX_ENTRIES = int(os.getenv('GPT_CACHE_MAX_ENTRIES', 256))
+gpt_result_cache = OrderedDict()  # key -> (stored_at, serialized result), oldest first
+
+# Also return the monthly breakdown and medians as top-level keys of the result
+INCLUDE_MONTHLY_BREAKDOWN = os.getenv('INCLUDE_MONTHLY_BREAKDOWN', 'false').lower() == 'true'
+
+
+async def memoized(fn, *args, ns):
+    """
+    Await fn(*args), reusing a stored result for the same inputs.
+    Results are kept serialized so callers never share mutable objects;
+    a PartialResult is returned without being stored.
+    """
+    key = f"{ns}:{blake2b(orjson.dumps(args, option=orjson.OPT_SORT_KEYS)).hexdigest()}"
+    entry = gpt_result_cache.get(key)
+    if entry:
+        stored_at, value = entry
+        if time.time() - stored_at < GPT_CACHE_TTL:
+            gpt_result_cache.move_to_end(key)
+            return orjson.loads(value)
+        del gpt_result_cache[key]
+
+    result = await fn(*args)
+    if isinstance(result, PartialResult):
+        # Retrying the statement should redo the failed chunks, not replay the fallback
+        print(f"   ⚠️ Not caching partial {ns} result")
+        return result
+    gpt_result_cache[key] = (time.time(), orjson.dumps(result))
+    while len(gpt_result_cache) > GPT_CACHE_MAX_ENTRIES:
+        gpt_result_cache.popitem(last=False)
+    return result
 
 
 async def process_bank_statement(file_bytes, task_id=None):
@@ -42,35 +82,27 @@ async def process_bank_statement(file_bytes, task_id=None):
     tables = await extract_tables_from_pdf(file_bytes)
     await progress_manager.update_progress(task_id, 40, "Completed Textract.", {"tables_extracted": len(tables)})
 
-    metadata = await analyze_table_structure(tables)
+    metadata = await memoized(analyze_table_structure, tables, ns="analysis")
     await progress_manager.update_progress(task_id, 60, "Analyzed table structure", {"headers": metadata.get('available_header', [])})
 
-    transactions = await extract_transactions(tables, metadata)
+    transactions = await memoized(extract_transactions, tables, metadata, ns="extraction")
     await progress_manager.update_progress(task_id, 80, "Extracted transactions", {"transactions_count": len(transactions)})
 
-    categorized = await categorize_transactions(transactions)
+    categorized = await memoized(categorize_transactions, transactions, ns="categorization")
     await progress_manager.update_progress(task_id, 90, "Categorization completed", {"categorized_count": len(categorized)})
 
-    # ✅ Generate Summaries
-    summary = generate_transaction_breakdown(categorized)
-    monthly_breakdown = calculate_monthly_breakdown(pd.DataFrame(categorized))
-    median_summary = calculate_median_summary(monthly_breakdown)
+    # ✅ Generate Summaries (pandas work runs off the event loop so other statements keep streaming)
+    summary = await asyncio.to_thread(generate_transaction_breakdown, categorized)
 
     final_data = {
         "transactions": categorized,
         "summary": summary,
-        # "monthly_breakdown": monthly_breakdown,
-        # "median_summary": median_summary
     }
+    if INCLUDE_MONTHLY_BREAKDOWN:
+        # Already computed inside the summary; expose them at the top level without recomputing
+        final_data["monthly_breakdown"] = summary["monthly_breakdown"]
+        final_data["median_summary"] = summary["median_summary"]
 
-    # await progress_manager.update_progress(task_id, 100, "Completed all processing", {"summary_generated": True})
-    await progress_manager.update_progress(
-    task_id,
-    progress=100,
-    message="Completed all processing",
-    data=final_data
-        )
-
-
+    # The caller publishes completion; the full result is fetched once rather than streamed
     return final_data
 
@@ -0,0 +1,120 @@
+import os
+import time
+import hashlib
+import orjson
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+from dotenv import load_dotenv
+load_dotenv()
+
+# Parsed GPT responses keyed on the request; only deterministic (temperature 0) requests are cached
+GPT_RESPONSE_CACHE_TTL = int(os.getenv('GPT_RESPONSE_CACHE_TTL', 7 * 86400))  # seconds
+GPT_RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('GPT_RESPONSE_CACHE_MAX_ENTRIES', 1024))
+
+# key -> (stored_at, serialized parsed response), oldest first
+response_cache = OrderedDict()
+
+
+def request_cache_key(request: Dict) -> Optional[str]:
+    """
+    SHA-256 of the parts of a chat completion request that determine its response.
+    
+    Args:
+        request (Dict): Chat completion request body
+    
+    Returns:
+        Optional[str]: Cache key, or None if the request is not deterministic
+    """
+    if request.get('temperature', 1) != 0:
+        return None
+    return hashlib.sha256(orjson.dumps(
+        {
+            "model": request['model'],
+            "messages": request['messages'],
+            "response_format": request.get('response_format')
+        },
+        option=orjson.OPT_SORT_KEYS
+    )).hexdigest()
+
+
+def estimate_request_tokens(request: Dict) -> int:
+    """
+    Rough token count of a chat completion request (about 4 characters per token),
+    including room for a response of similar size.
+    """
+    return 2 * len(orjson.dumps(request['messages'])) // 4
+
+
+async def cached_chat_create(client, parse_response: Callable[[str], object], limiter=None, **request) -> object:
+    """
+    Run a chat completion and parse its content, reusing the parsed result of an identical request.
+    Only responses that parse successfully are stored, so a retry after a bad response calls GPT again.
+    
+    Args:
+        client: AsyncOpenAI client
+        parse_response (Callable[[str], object]): Parses and validates the message content
+        limiter (AsyncRateLimiter): Rate limiter to hold while the request is in flight (cache hits skip it)
+        **request: Chat completion request body
+    
+    Returns:
+        object: Parsed response
+    
+    Raises:
+        ValueError: If the model refused the request
+    """
+    key = request_cache_key(request)
+    if key:
+        entry = response_cache.get(key)
+        if entry:
+            stored_at, value = entry
+            if time.time() - stored_at < GPT_RESPONSE_CACHE_TTL:
+                response_cache.move_to_end(key)
+                return orjson.loads(value)
+            del response_cache[key]
+
+    if limiter:
+        async with limiter.limit(estimate_request_tokens(request)) as reservation:
+            response = await client.chat.completions.create(**request)
+            usage = getattr(response, 'usage', None)
+            if usage:
+                limiter.record_usage(reservation, usage.total_tokens)
+    else:
+        response = await client.chat.completions.create(**request)
+    message = response.choices[0].message
+    if getattr(message, 'refusal', None):
+        raise ValueError(f"Request refused: {message.refusal}")
+    result = parse_response(message.content)
+
+    if key:
+        response_cache[key] = (time.time(), orjson.dumps(result))
+        while len(response_cache) > GPT_RESPONSE_CACHE_MAX_ENTRIES:
+            response_cache.popitem(last=False)
+    return result
+
+
+# Category per normalized transaction, so merchants repeated across chunks and statements are only
+# categorized once; keys carry a prompt version so prompt or model changes start a fresh cache
+CATEGORY_CACHE_MAX_ENTRIES = int(os.getenv('CATEGORY_CACHE_MAX_ENTRIES', 50000))
+
+# key -> category, least recently used first
+category_cache = OrderedDict()
+
+
+def get_cached_category(key: tuple) -> Optional[str]:
+    """
+    Look up the category previously assigned to a normalized transaction.
+    """
+    category = category_cache.get(key)
+    if category:
+        category_cache.move_to_end(key)
+    return category
+
+
+def cache_category(key: tuple, category: str) -> None:
+    """
+    Remember the category assigned to a normalized transaction.
+    """
+    category_cache[key] = category
+    category_cache.move_to_end(key)
+    while len(category_cache) > CATEGORY_CACHE_MAX_ENTRIES:
+        category_cache.popitem(last=False)
@@ -1,6 +1,12 @@
 import os
 import json
-from openai import AsyncOpenAI
+import orjson
+import random
+import asyncio
+import httpx
+from typing import Awaitable, Callable, Dict
+from openai import AsyncOpenAI, RateLimitError
+from rate_limiter import AsyncRateLimiter
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -8,7 +14,44 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY environment variable is required")
 
-openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+# One pooled HTTP client shared by every OpenAI call so parallel chunk requests reuse
+# warm connections instead of paying a TLS handshake each; HTTP/2 multiplexes them
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', 100))
+OPENAI_HTTP2 = os.getenv('OPENAI_HTTP2', 'true').lower() == 'true'
+
+# Shared by all chunk workers so a large statement cannot exceed the OpenAI rate limits;
+# set the per-minute budgets to the account's tier limits
+GPT_MAX_CONCURRENCY = int(os.getenv('GPT_MAX_CONCURRENCY', 8))  # Concurrent chunk requests to OpenAI
+OPENAI_RPM_LIMIT = int(os.getenv('OPENAI_RPM_LIMIT', 5000))
+OPENAI_TPM_LIMIT = int(os.getenv('OPENAI_TPM_LIMIT', 1_500_000))
+gpt_rate_limiter = AsyncRateLimiter(rpm=OPENAI_RPM_LIMIT, tpm=OPENAI_TPM_LIMIT, max_concurrent=GPT_MAX_CONCURRENCY)
+
+
+async def track_rate_limits(response: httpx.Response) -> None:
+    gpt_rate_limiter.update_from_headers(response.headers)
+
+
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_CONNECTIONS // 2,
+        keepalive_expiry=30.0
+    ),
+    timeout=httpx.Timeout(60.0, connect=5.0),
+    http2=OPENAI_HTTP2,
+    event_hooks={'response': [track_rate_limits]}
+)
+
+openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http_client)
+
+# GPT retry backoff (seconds): full jitter, so failed chunks do not retry in lockstep
+GPT_RETRY_BASE = float(os.getenv('GPT_RETRY_BASE', 1))
+GPT_RETRY_CAP = float(os.getenv('GPT_RETRY_CAP', 30))
+
+# Batch API status polling backoff (seconds)
+BATCH_POLL_BASE = float(os.getenv('OPENAI_BATCH_POLL_BASE', 5))
+BATCH_POLL_CAP = float(os.getenv('OPENAI_BATCH_POLL_CAP', 60))
+BATCH_TERMINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
 
 # async def run_gpt(prompt: str, model: str = 'gpt-4.1-nano', system_prompt: str = 'You are a financial data assistant.', format_type: str = 'json_object') -> dict:
 #     """
@@ -60,22 +103,134 @@ openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
 #     return json.loads(response.choices[0].message.content)
 
-async def run_gpt(prompt: str, model: str = 'gpt-4o', system_prompt: str = 'You are a financial data assistant.', format_type: str = 'json_object') -> dict:
+async def run_gpt(prompt: str, model: str = 'gpt-4o', system_prompt: str = 'You are a financial data assistant.', format_type: str | dict = 'json_object') -> dict:
     """
     Unified GPT caller for processing prompts and returning parsed JSON.
+    The gpt-4o default suits extraction-grade prompts; pass a smaller model such as
+    gpt-4.1-nano for cheap labeling stages (see the per-stage models in gpt_service).
+    format_type is either a response format type name or a full response_format dict,
+    such as a strict json_schema format.
     """
     # Construct the response_format param as dict
-    response_format_param = {"type": format_type} if format_type else None
-
-    response = await openai_client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": prompt}
-        ],
-        response_format=response_format_param,
-        temperature=0.0
+    if isinstance(format_type, dict):
+        response_format_param = format_type
+    else:
+        response_format_param = {"type": format_type} if format_type else None
+
+    # Malformed JSON gets one immediate retry here before the error reaches the caller
+    for attempt in range(2):
+        response = await openai_client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            response_format=response_format_param,
+            temperature=0.0
+        )
+        try:
+            return orjson.loads(response.choices[0].message.content)
+        except orjson.JSONDecodeError:
+            if attempt:
+                raise
+            print("   - Warning: Invalid JSON from GPT, retrying once...")
+
+def get_retry_after(error: Exception) -> float:
+    """
+    Seconds OpenAI asked us to wait before retrying a rate-limited request, or 0 if not given.
+    """
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after is None and isinstance(error, RateLimitError):
+        headers = error.response.headers
+        try:
+            if 'retry-after-ms' in headers:
+                retry_after = float(headers['retry-after-ms']) / 1000
+            else:
+                retry_after = float(headers.get('retry-after', 0))
+        except ValueError:
+            retry_after = 0
+    return float(retry_after or 0)
+
+
+def describe_gpt_error(error: Exception) -> str:
+    if isinstance(error, json.JSONDecodeError):
+        return f"Invalid JSON response: {str(error)}"
+    if isinstance(error, ValueError):
+        return f"Validation error: {str(error)}"
+    return f"Error: {str(error)}"
+
+
+async def retry_gpt(coro_factory: Callable[[int], Awaitable], max_retries: int = 3, label: str = '   -'):
+    """
+    Await coro_factory(attempt) until it succeeds, sleeping with jittered exponential backoff
+    between attempts. Rate-limited attempts wait at least as long as the Retry-After header asks.
+
+    Args:
+        coro_factory (Callable[[int], Awaitable]): Builds the coroutine for a (0-based) attempt
+        max_retries (int): Maximum number of attempts
+        label (str): Log prefix
+
+    Returns:
+        The result of the first successful attempt
+
+    Raises:
+        Exception: The error of the last attempt
+    """
+    for attempt in range(max_retries):
+        try:
+            return await coro_factory(attempt)
+        except Exception as e:
+            print(f"{label} Warning: {describe_gpt_error(e)}")
+            if attempt + 1 >= max_retries:
+                raise
+            delay = random.uniform(0, min(GPT_RETRY_BASE * 2 ** attempt, GPT_RETRY_CAP))
+            delay = max(delay, get_retry_after(e))
+            print(f"{label} Retrying in {delay:.1f}s (attempt {attempt + 2}/{max_retries})...")
+            await asyncio.sleep(delay)
+
+
+async def run_gpt_batch(requests: Dict[str, dict]) -> Dict[str, str]:
+    """
+    Submit chat completion requests through the OpenAI Batch API and wait for the results.
+    Batch requests are billed at half price and use a separate rate-limit pool,
+    at the cost of latency (the completion window is up to 24h).
+
+    Args:
+        requests (Dict[str, dict]): Mapping of custom_id to chat completion request body
+
+    Returns:
+        Dict[str, str]: Message content per custom_id for the requests that succeeded
+    """
+    lines = [
+        orjson.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body})
+        for custom_id, body in requests.items()
+    ]
+    batch_file = await openai_client.files.create(
+        file=("batch_requests.jsonl", b"\n".join(lines)),
+        purpose="batch"
+    )
+    batch = await openai_client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
     )
 
-    return json.loads(response.choices[0].message.content)
+    attempt = 0
+    while batch.status not in BATCH_TERMINAL_STATUSES:
+        await asyncio.sleep(min(BATCH_POLL_CAP, BATCH_POLL_BASE * 2 ** attempt))
+        attempt += 1
+        batch = await openai_client.batches.retrieve(batch.id)
+
+    if batch.status != 'completed' or not batch.output_file_id:
+        raise Exception(f"OpenAI batch {batch.id} ended with status {batch.status}")
 
+    output = await openai_client.files.content(batch.output_file_id)
+    results = {}
+    for line in output.text.splitlines():
+        if not line.strip():
+            continue
+        item = orjson.loads(line)
+        response = item.get("response") or {}
+        if response.get("status_code") == 200:
+            results[item["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+    return results
@@ -1,12 +1,20 @@
-from openai import AsyncOpenAI
 import os
+import re
 import json
-from typing import Dict, List
+import hashlib
+import orjson
+from typing import Dict, Iterable, List
 from dotenv import load_dotenv
-from prompts import get_analysis_prompt, get_extraction_prompt, get_categorization_prompt
-from gpt_client import run_gpt
+from prompts import get_analysis_prompt, get_analysis_with_extraction_prompt, get_extraction_prefix, get_extraction_prompt, get_multi_chunk_extraction_prefix, get_multi_chunk_extraction_prompt, get_categorization_instructions, get_categorization_prompt
+from gpt_client import openai_client, gpt_rate_limiter, retry_gpt, run_gpt, run_gpt_batch
+from gpt_cache import cached_chat_create, get_cached_category, cache_category
+from local_categorizer import find_similar_categories, remember_categories
+from models import TableAnalysis, TableAnalysisWithTransactions, TransactionList, ChunkTransactionList, CategorizedTransactionList
+from openai.lib._pydantic import to_strict_json_schema
+from pydantic import BaseModel
 import asyncio
 import time
+import numpy as np
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -18,6 +26,32 @@ if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY environment variable is required")
 
 DEFAULT_CHUNK_SIZE = 5  # Default if dynamic calculation is skipped
+EXTRACTION_CHUNKS_PER_REQUEST = int(os.getenv('EXTRACTION_CHUNKS_PER_REQUEST', 4))  # Table chunks packed into one completion
+EXTRACTION_MAX_CHUNK_ROWS = int(os.getenv('EXTRACTION_MAX_CHUNK_ROWS', 100))  # Keeps packed responses within the output token limit
+ANALYSIS_SAMPLE_ROWS = int(os.getenv('ANALYSIS_SAMPLE_ROWS', 50))  # Table rows sent for structure analysis
+# Statements that fit entirely in the analysis sample are extracted by the analysis call itself
+ANALYSIS_FUSED_EXTRACTION = os.getenv('ANALYSIS_FUSED_EXTRACTION', 'true').lower() == 'true'
+
+# Model per stage: structure analysis and categorization are simple labeling tasks that run
+# well on the smallest model; extraction can be moved to a larger one independently
+ANALYSIS_MODEL = os.getenv('ANALYSIS_MODEL', 'gpt-4.1-nano')
+EXTRACTION_MODEL = os.getenv('EXTRACTION_MODEL', 'gpt-4.1-nano')
+CATEGORIZATION_MODEL = os.getenv('CATEGORIZATION_MODEL', 'gpt-4.1-nano')
+
+# Categorization has no interactive consumer, so it can go through the Batch API at half the
+# token price; statements with only a few transactions are not worth the batch turnaround
+CATEGORIZATION_USE_BATCH = os.getenv('CATEGORIZATION_USE_BATCH', 'false').lower() == 'true'
+CATEGORIZATION_BATCH_MIN_SIZE = int(os.getenv('CATEGORIZATION_BATCH_MIN_SIZE', 10))
+
+# Reuse categories of similar, already categorized descriptions (one embeddings request per statement)
+CATEGORIZATION_EMBEDDING_LOOKUP = os.getenv('CATEGORIZATION_EMBEDDING_LOOKUP', 'false').lower() == 'true'
+
+
+class PartialResult(list):
+    """
+    Stage result in which some chunks fell back after exhausting their retries.
+    Usable like a plain list, but must not be cached as the stage's result.
+    """
 
 
 def calculate_dynamic_chunk_size(total_items, average_table_length=0):
@@ -44,18 +78,16 @@ def calculate_dynamic_chunk_size(total_items, average_table_length=0):
 
 
 
-# Initialize OpenAI client
-openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-
-async def analyze_table_structure(tables: Dict[str, List[List[str]]]) -> Dict:
+async def analyze_table_structure(tables: List[List[List[str]]]) -> Dict:
     """
     Analyze the structure of extracted tables to understand headers and format.
     
     Args:
-        tables (Dict[str, List[List[str]]]): Dictionary of extracted tables
+        tables (List[List[List[str]]]): Extracted tables in document order
     
     Returns:
-        Dict: Analysis result containing headers, example transactions, and column mapping
+        Dict: Analysis result containing headers, example transactions, and column mapping,
+            plus all transactions when the statement is small enough to extract in the same call
     """
     try:
         # Check if tables are empty
@@ -64,7 +96,7 @@ async def analyze_table_structure(tables: Dict[str, List[List[str]]]) -> Dict:
         
         # Check if any table has data
         has_data = False
-        for table_data in tables.values():
+        for table_data in tables:
             if table_data and len(table_data) > 0:
                 has_data = True
                 break
@@ -72,224 +104,532 @@ async def analyze_table_structure(tables: Dict[str, List[List[str]]]) -> Dict:
         if not has_data:
             raise Exception("No data found in the extracted tables")
         
-        # Combine all tables into a single text for analysis
-        combined_text = ""
-        for table_key, table_data in tables.items():
-            combined_text += f"\n Table {table_key}\n"
-            for row in table_data:
-                combined_text += f"[{' | '.join(str(cell) for cell in row)}]" + "\n"
-
-        print("   - Analyzing table structure...")
+        # Headers and the first transactions only need the leading tables, not the whole statement
+        sample_tables = []
+        sample_rows = 0
+        for table_num, table_data in enumerate(tables, 1):
+            sample_tables.append(table_num)
+            sample_rows += len(table_data)
+            if sample_rows >= ANALYSIS_SAMPLE_ROWS:
+                break
+        combined_text = format_chunk_tables(sample_tables, tables)
+
+        # A small statement is seen whole here, so one call can analyze and extract it
+        with_transactions = ANALYSIS_FUSED_EXTRACTION and len(sample_tables) == len(tables) and sample_rows <= ANALYSIS_SAMPLE_ROWS
+        print(f"   - Analyzing table structure{' and extracting transactions' if with_transactions else ''}...")
         max_retries = 3
-        retry_count = 0
+        request = build_analysis_request(combined_text, with_transactions)
 
-        while retry_count < max_retries:
-            try:
-                analysis_prompt = get_analysis_prompt(combined_text)
-
-                response = await openai_client.chat.completions.create(
-                    model='gpt-4.1-nano',
-                    messages=[
-                        {
-                            "role": "system", 
-                            "content": "You are a financial data analysis expert. Analyze table structure and extract headers and example transactions."
-                        },
-                        {"role": "user", "content": analysis_prompt}
-                    ],
-                    response_format={ "type": "json_object" },
-                    temperature=0.0  # Use deterministic output
-                )
+        try:
+            result = await retry_gpt(
+                lambda attempt: cached_chat_create(openai_client, parse_analysis_response, gpt_rate_limiter, **request),
+                max_retries
+            )
+        except Exception:
+            print(f"   ! Failed to analyze table structure after {max_retries} attempts")
+            raise Exception("Failed to analyze table structure after maximum retries")
 
-                result = json.loads(response.choices[0].message.content)
-                
-                # Validate response structure
-                required_fields = ['available_header', 'example_transactions', 'column_types']
-                if not all(field in result for field in required_fields):
-                    raise ValueError("Missing required fields in analysis response")
-                
-                if not result['example_transactions']:
-                    raise ValueError("No example transactions found")
-                
-                print(f"   ✓ Found {len(result['available_header'])} headers and {len(result['example_transactions'])} example transactions")
-                return result
-
-            except json.JSONDecodeError as e:
-                error_msg = f"Invalid JSON response: {str(e)}"
-                print(f"   - Warning: {error_msg}")
-                retry_count += 1
-            except ValueError as e:
-                error_msg = f"Validation error: {str(e)}"
-                print(f"   - Warning: {error_msg}")
-                retry_count += 1
-            except Exception as e:
-                error_msg = f"Error analyzing table structure: {str(e)}"
-                print(f"   - Warning: {error_msg}")
-                retry_count += 1
-            
-            if retry_count < max_retries:
-                print(f"   - Retrying analysis (attempt {retry_count + 1}/{max_retries})...")
-            else:
-                print(f"   ! Failed to analyze table structure after {max_retries} attempts")
-                raise Exception("Failed to analyze table structure after maximum retries")
+        print(f"   ✓ Found {len(result['available_header'])} headers and {len(result['example_transactions'])} example transactions")
+        return result
 
     except Exception as e:
         raise Exception(f"Failed to analyze table structure: {str(e)}")
 
-async def process_chunk_async(chunk_tables: List[str], tables: Dict[str, List[List[str]]], text_context: str, chunk_num: int, max_retries: int = 3) -> List[Dict]:
+# Fields each GPT response must provide
+REQUIRED_TRANSACTION_FIELDS = frozenset(('date', 'description', 'debit', 'credit', 'balance'))
+REQUIRED_CATEGORIZED_FIELDS = REQUIRED_TRANSACTION_FIELDS | {'category'}
+VALID_CATEGORY_PREFIXES = ('income.', 'expense.', 'transfer.')
+
+ANALYSIS_SYSTEM_PROMPT = "You are a financial data analysis expert. Analyze table structure and extract headers and example transactions."
+EXTRACTION_SYSTEM_PROMPT = "You are a financial data extraction expert. Extract transactions exactly matching the example format. Return only valid JSON array."
+CATEGORIZATION_SYSTEM_PROMPT = "You are a financial transaction categorization expert. Categorize transactions based on their description, amount, and patterns."
+CATEGORIZATION_SYSTEM_MESSAGE = f"{CATEGORIZATION_SYSTEM_PROMPT}\n{get_categorization_instructions()}"
+
+
+def structured_output_format(model: type[BaseModel]) -> Dict:
+    """
+    Build a strict json_schema response_format so OpenAI enforces the model's structure server-side.
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": model.__name__,
+            "schema": to_strict_json_schema(model),
+            "strict": True
+        }
+    }
+
+
+ANALYSIS_RESPONSE_FORMAT = structured_output_format(TableAnalysis)
+ANALYSIS_WITH_EXTRACTION_RESPONSE_FORMAT = structured_output_format(TableAnalysisWithTransactions)
+EXTRACTION_RESPONSE_FORMAT = structured_output_format(TransactionList)
+MULTI_CHUNK_EXTRACTION_RESPONSE_FORMAT = structured_output_format(ChunkTransactionList)
+CATEGORIZATION_RESPONSE_FORMAT = structured_output_format(CategorizedTransactionList)
+
+
+def format_chunk_tables(chunk_tables: Iterable[int], tables: List[List[List[str]]]) -> str:
+    """
+    Format the tables of a chunk as the text block sent to GPT.
+    """
+    parts = []
+    for table_num in chunk_tables:
+        parts.append(f"\n Table {table_num}\n")
+        for row in tables[table_num - 1]:
+            parts.append('[' + ' | '.join(map(str, row)) + ']\n')
+    return ''.join(parts)
+
+
+# Changes to the categorization model or prompt invalidate previously cached categories
+CATEGORIZATION_PROMPT_VERSION = hashlib.sha256(
+    f"{CATEGORIZATION_MODEL}\n{CATEGORIZATION_SYSTEM_MESSAGE}\n{get_categorization_prompt([])}".encode()
+).hexdigest()[:12]
+
+
+def category_cache_key(transaction: Dict) -> tuple:
+    """
+    Cache key for a transaction's category: the description with digits and whitespace collapsed
+    (so reference numbers and dates do not matter) and whether money came in or went out.
+    """
+    description = re.sub(r'\d+|\s+', ' ', str(transaction.get('description') or '')).strip().lower()
+    try:
+        direction = 'credit' if float(transaction.get('credit') or 0) > 0 else 'debit'
+    except (TypeError, ValueError):
+        direction = 'debit'
+    return (CATEGORIZATION_PROMPT_VERSION, description, direction)
+
+
+async def prefill_similar_categories(transactions: List[Dict]) -> List[tuple]:
+    """
+    Seed the category cache for transactions whose description is close to an already
+    categorized one, so their chunks skip GPT for them.
+    
+    Returns:
+        List[tuple]: (cache key, vector) of the descriptions still left for GPT, for learn_similar_categories
+    """
+    keys = list(dict.fromkeys(
+        key for key in map(category_cache_key, transactions) if not get_cached_category(key)
+    ))
+    if not keys:
+        return []
+    try:
+        categories, vectors = await find_similar_categories([f"{direction}: {description}" for _, description, direction in keys])
+    except Exception as e:
+        print(f"   ⚠️ Similar category lookup failed, categorizing with GPT only: {str(e)}")
+        return []
+
+    pending = []
+    for key, category, vector in zip(keys, categories, vectors):
+        if category:
+            cache_category(key, category)
+        else:
+            pending.append((key, vector))
+    print(f"   - {len(keys) - len(pending)} of {len(keys)} new descriptions matched similar categorized ones")
+    return pending
+
+
+def learn_similar_categories(pending: List[tuple]) -> None:
+    """
+    Index the descriptions GPT categorized, see prefill_similar_categories.
+    Descriptions whose categorization failed were never cached and are skipped.
+    """
+    learned = [(vector, get_cached_category(key)) for key, vector in pending if get_cached_category(key)]
+    if learned:
+        vectors, labels = zip(*learned)
+        remember_categories(np.stack(vectors), list(labels))
+
+
+def build_analysis_request(combined_text: str, with_transactions: bool = False) -> Dict:
+    """
+    Build the chat completion request body for analyzing the table structure,
+    optionally also extracting the transactions of the given tables.
+    """
+    if with_transactions:
+        # Extraction quality matters more than analysis here, so use the extraction model
+        model, prompt, response_format = (
+            EXTRACTION_MODEL, get_analysis_with_extraction_prompt(combined_text), ANALYSIS_WITH_EXTRACTION_RESPONSE_FORMAT
+        )
+    else:
+        model, prompt, response_format = ANALYSIS_MODEL, get_analysis_prompt(combined_text), ANALYSIS_RESPONSE_FORMAT
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        "response_format": response_format,
+        "temperature": 0.0  # Use deterministic output
+    }
+
+
+def build_extraction_request(text_context: str, combined_text: str) -> Dict:
+    """
+    Build the chat completion request body for extracting transactions from a chunk.
+    The instructions and context go in their own message, identical for every chunk of a
+    statement, so OpenAI's prompt caching can reuse them; the chunk's tables come last.
+    """
+    return {
+        "model": EXTRACTION_MODEL,
+        "messages": [
+            {"role": "system", "content": EXTRACTION_SYSTEM_PROMPT},
+            {"role": "user", "content": get_extraction_prefix(text_context)},
+            {"role": "user", "content": get_extraction_prompt(combined_text)}
+        ],
+        "response_format": EXTRACTION_RESPONSE_FORMAT,
+        "temperature": 0.0  # Use deterministic output
+    }
+
+
+def build_multi_chunk_extraction_request(text_context: str, chunk_texts: Dict[int, str]) -> Dict:
+    """
+    Build one chat completion request body extracting several chunks at once.
+    The system prompt and text context are sent once for all of them.
+    """
+    return {
+        "model": EXTRACTION_MODEL,
+        "messages": [
+            {"role": "system", "content": EXTRACTION_SYSTEM_PROMPT},
+            {"role": "user", "content": get_multi_chunk_extraction_prefix(text_context)},
+            {"role": "user", "content": get_multi_chunk_extraction_prompt(chunk_texts)}
+        ],
+        "response_format": MULTI_CHUNK_EXTRACTION_RESPONSE_FORMAT,
+        "temperature": 0.0  # Use deterministic output
+    }
+
+
+def build_categorization_request(chunk: List[Dict]) -> Dict:
+    """
+    Build the chat completion request body for categorizing a chunk of transactions.
+    """
+    return {
+        "model": CATEGORIZATION_MODEL,
+        "messages": [
+            {"role": "system", "content": CATEGORIZATION_SYSTEM_MESSAGE},
+            {"role": "user", "content": get_categorization_prompt(chunk)}
+        ],
+        "response_format": CATEGORIZATION_RESPONSE_FORMAT,
+        "temperature": 0.0  # Use deterministic output
+    }
+
+
+def parse_analysis_response(content: str) -> Dict:
+    """
+    Parse and validate the GPT response for the table structure analysis.
+    The schema guarantees the structure, only the content needs checking.
+    
+    Raises:
+        orjson.JSONDecodeError: If the response is not valid JSON
+        ValueError: If no example transactions were found, or extracted transactions are malformed
+    """
+    result = orjson.loads(content)
+    if not result['example_transactions']:
+        raise ValueError("No example transactions found")
+    if 'transactions' in result:
+        validate_extracted_transactions(result, 1)
+    return result
+
+
+def parse_extraction_response(content: str, chunk_num: int) -> List[Dict]:
+    """
+    Parse and validate the GPT response for an extraction chunk.
+    
+    Raises:
+        orjson.JSONDecodeError: If the response is not valid JSON
+        ValueError: If the response does not have the expected structure
+    """
+    return validate_extracted_transactions(orjson.loads(content), chunk_num)
+
+
+def validate_extracted_transactions(chunk_transactions, chunk_num: int) -> List[Dict]:
+    """
+    Validate the decoded extraction result of a chunk and return its transactions.
+    
+    Raises:
+        ValueError: If the result does not have the expected structure
+    """
+    # Validate response format and structure
+    if isinstance(chunk_transactions, dict) and 'transactions' in chunk_transactions:
+        transactions_list = chunk_transactions['transactions']
+        if not isinstance(transactions_list, list):
+            raise ValueError(f"Invalid transactions format in chunk {chunk_num}")
+    elif isinstance(chunk_transactions, list):
+        transactions_list = chunk_transactions
+    else:
+        raise ValueError(f"Invalid response format for chunk {chunk_num}")
+    
+    # Validate each transaction has required fields
+    for tx in transactions_list:
+        if not REQUIRED_TRANSACTION_FIELDS <= tx.keys():
+            raise ValueError("Missing required fields in transaction")
+    
+    return transactions_list
+
+
+def parse_categorization_response(content: str, expected_count: int = None) -> List[Dict]:
+    """
+    Parse and validate the GPT response for a categorization chunk.
+    
+    Args:
+        content: Message content of the response
+        expected_count: Number of transactions sent, if the response must return each of them
+    
+    Raises:
+        orjson.JSONDecodeError: If the response is not valid JSON
+        ValueError: If the response does not have the expected structure or transaction count
+    """
+    result = orjson.loads(content)
+    
+    # Validate response format
+    if not isinstance(result, dict) or 'transactions' not in result:
+        raise ValueError("Invalid response format")
+    
+    chunk_transactions = result['transactions']
+    if expected_count is not None and len(chunk_transactions) != expected_count:
+        raise ValueError(f"Expected {expected_count} categorized transactions, got {len(chunk_transactions)}")
+    
+    # Validate each transaction has required fields
+    for tx in chunk_transactions:
+        if not REQUIRED_CATEGORIZED_FIELDS <= tx.keys():
+            raise ValueError("Missing required fields in transaction")
+        
+        # Validate category format
+        category = tx['category']
+        if not isinstance(category, str) or '.' not in category:
+            raise ValueError(f"Invalid category format: {category}")
+        
+        if not category.startswith(VALID_CATEGORY_PREFIXES):
+            raise ValueError(f"Invalid category type: {category.partition('.')[0]}")
+    
+    return chunk_transactions
+
+
+def parse_batch_result(contents: Dict[str, str], custom_id: str, parse_response) -> object:
+    """
+    Parse one chunk's result from an OpenAI batch.
+    Errors are returned instead of raised, matching asyncio.gather(return_exceptions=True),
+    so failed chunks go through the same handling as in the parallel path.
+    """
+    try:
+        if custom_id not in contents:
+            raise ValueError(f"No batch result for {custom_id}")
+        return parse_response(contents[custom_id])
+    except Exception as e:
+        return e
+
+
+async def process_chunk_async(chunk_tables: List[int], tables: List[List[List[str]]], text_context: str, chunk_num: int, max_retries: int = 3) -> List[Dict]:
     """
     Process a single chunk of tables asynchronously.
     
     Args:
-        chunk_tables: List of table keys in this chunk
-        tables: Dictionary of all tables
+        chunk_tables: Numbers (1-based) of the tables in this chunk
+        tables: All extracted tables in document order
         text_context: Context information for extraction
         chunk_num: Chunk number for logging
         max_retries: Maximum number of retry attempts
     
     Returns:
         List[Dict]: List of transactions extracted from this chunk
+    
+    Raises:
+        Exception: If the chunk still fails after max_retries attempts
     """
     start_time = time.time()
-    print(f"   🚀 [CHUNK {chunk_num}] Starting parallel processing (tables: {', '.join(chunk_tables)})...")
-    combined_text = ""
-    retry_count = 0
+    print(f"   🚀 [CHUNK {chunk_num}] Starting parallel processing (tables: {', '.join(map(str, chunk_tables))})...")
 
     # Format tables in the chunk
-    for table_key in chunk_tables:
-        combined_text += f"\n Table {table_key}\n"
-        for row in tables[table_key]:
-            combined_text += f"[{' | '.join(str(cell) for cell in row)}]" + "\n"
+    combined_text = format_chunk_tables(chunk_tables, tables)
+    request = build_extraction_request(text_context, combined_text)
 
-    while retry_count < max_retries:
-        try:
-            print(f"      📡 [CHUNK {chunk_num}] Sending to GPT API (attempt {retry_count + 1}/{max_retries})...")
-            extraction_prompt = get_extraction_prompt(text_context, combined_text)
-
-            response = await openai_client.chat.completions.create(
-                model='gpt-4.1-nano',
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": "You are a financial data extraction expert. Extract transactions exactly matching the example format. Return only valid JSON array."
-                    },
-                    {"role": "user", "content": extraction_prompt}
-                ],
-                response_format={ "type": "json_object" },
-                temperature=0.0  # Use deterministic output
-            )
+    async def attempt_extraction(attempt: int) -> List[Dict]:
+        print(f"      📡 [CHUNK {chunk_num}] Sending to GPT API (attempt {attempt + 1}/{max_retries})...")
+        return await cached_chat_create(
+            openai_client, lambda content: parse_extraction_response(content, chunk_num), gpt_rate_limiter, **request
+        )
 
-            chunk_transactions = json.loads(response.choices[0].message.content)
-            
-            # Validate response format and structure
-            if isinstance(chunk_transactions, dict) and 'transactions' in chunk_transactions:
-                transactions_list = chunk_transactions['transactions']
-                if isinstance(transactions_list, list):
-                    # Validate each transaction has required fields
-                    for tx in transactions_list:
-                        required_fields = ['date', 'description', 'debit', 'credit', 'balance']
-                        if not all(field in tx for field in required_fields):
-                            raise ValueError("Missing required fields in transaction")
-                    
-                    elapsed = time.time() - start_time
-                    print(f"      ✅ [CHUNK {chunk_num}] Completed in {elapsed:.1f}s - Found {len(transactions_list)} transactions")
-                    return transactions_list
-                else:
-                    raise ValueError(f"Invalid transactions format in chunk {chunk_num}")
-            elif isinstance(chunk_transactions, list):
-                # Validate each transaction has required fields
-                for tx in chunk_transactions:
-                    required_fields = ['date', 'description', 'debit', 'credit', 'balance']
-                    if not all(field in tx for field in required_fields):
-                        raise ValueError("Missing required fields in transaction")
-                
-                elapsed = time.time() - start_time
-                print(f"      ✅ [CHUNK {chunk_num}] Completed in {elapsed:.1f}s - Found {len(chunk_transactions)} transactions")
-                return chunk_transactions
-            else:
-                raise ValueError(f"Invalid response format for chunk {chunk_num}")
-
-        except json.JSONDecodeError as e:
-            error_msg = f"Invalid JSON response in chunk {chunk_num}: {str(e)}"
-            print(f"      ⚠️ [CHUNK {chunk_num}] Warning: {error_msg}")
-            retry_count += 1
-        except ValueError as e:
-            error_msg = f"Validation error in chunk {chunk_num}: {str(e)}"
-            print(f"      ⚠️ [CHUNK {chunk_num}] Warning: {error_msg}")
-            retry_count += 1
-        except Exception as e:
-            error_msg = f"Error processing chunk {chunk_num}: {str(e)}"
-            print(f"      ⚠️ [CHUNK {chunk_num}] Warning: {error_msg}")
-            retry_count += 1
-        
-        if retry_count < max_retries:
-            print(f"      🔄 [CHUNK {chunk_num}] Retrying (attempt {retry_count + 1}/{max_retries})...")
-        else:
-            print(f"      ❌ [CHUNK {chunk_num}] Failed after {max_retries} attempts")
-            # Return empty list for failed chunk
-            return []
+    try:
+        transactions_list = await retry_gpt(attempt_extraction, max_retries, f"      ⚠️ [CHUNK {chunk_num}]")
+    except Exception:
+        print(f"      ❌ [CHUNK {chunk_num}] Failed after {max_retries} attempts")
+        raise Exception(f"Chunk {chunk_num} failed after {max_retries} attempts")
+
+    elapsed = time.time() - start_time
+    print(f"      ✅ [CHUNK {chunk_num}] Completed in {elapsed:.1f}s - Found {len(transactions_list)} transactions")
+    return transactions_list
+
+def parse_multi_chunk_extraction_response(content: str, chunk_nums: List[int]) -> List[List[Dict]]:
+    """
+    Parse and validate a packed extraction response, returning the transactions of each chunk in order.
+    
+    Raises:
+        orjson.JSONDecodeError: If the response is not valid JSON
+        ValueError: If a chunk is missing or does not have the expected structure
+    """
+    result = orjson.loads(content)
+    if not isinstance(result, dict) or not isinstance(result.get('chunks'), list):
+        raise ValueError("Invalid response format for packed chunks")
+    
+    by_id = {}
+    for entry in result['chunks']:
+        if isinstance(entry, dict) and 'id' in entry:
+            try:
+                by_id[int(entry['id'])] = entry
+            except (TypeError, ValueError):
+                continue
+    
+    missing = [chunk_num for chunk_num in chunk_nums if chunk_num not in by_id]
+    if missing:
+        raise ValueError(f"Missing chunks in packed response: {missing}")
+    
+    return [validate_extracted_transactions(by_id[chunk_num], chunk_num) for chunk_num in chunk_nums]
+
+
+async def process_chunk_group_async(chunk_group: List[tuple], tables: List[List[List[str]]], text_context: str, max_retries: int = 3) -> List[object]:
+    """
+    Extract several chunks of tables with a single GPT request.
+    If the packed request keeps failing, the chunks are retried one request each.
+    
+    Args:
+        chunk_group: List of (chunk_tables, chunk_num) tuples packed together
+        tables: All extracted tables in document order
+        text_context: Context information for extraction
+        max_retries: Maximum number of retry attempts
+    
+    Returns:
+        List[object]: Transactions list (or exception) per chunk, in the order of chunk_group
+    """
+    if len(chunk_group) == 1:
+        chunk_tables, chunk_num = chunk_group[0]
+        return [await process_chunk_async(chunk_tables, tables, text_context, chunk_num, max_retries)]
+    
+    start_time = time.time()
+    chunk_nums = [chunk_num for _, chunk_num in chunk_group]
+    label = f"CHUNKS {chunk_nums[0]}-{chunk_nums[-1]}"
+    print(f"   🚀 [{label}] Starting packed processing of {len(chunk_group)} chunks...")
+    request = build_multi_chunk_extraction_request(
+        text_context,
+        {chunk_num: format_chunk_tables(chunk_tables, tables) for chunk_tables, chunk_num in chunk_group}
+    )
+    
+    async def attempt_packed_extraction(attempt: int) -> List[List[Dict]]:
+        print(f"      📡 [{label}] Sending to GPT API (attempt {attempt + 1}/{max_retries})...")
+        return await cached_chat_create(
+            openai_client, lambda content: parse_multi_chunk_extraction_response(content, chunk_nums), gpt_rate_limiter,
+            **request
+        )
+    
+    try:
+        results = await retry_gpt(attempt_packed_extraction, max_retries, f"      ⚠️ [{label}]")
+        elapsed = time.time() - start_time
+        print(f"      ✅ [{label}] Completed in {elapsed:.1f}s - Found {sum(len(r) for r in results)} transactions")
+        return results
+    except Exception:
+        pass
+    
+    print(f"      🔄 [{label}] Packed request failed after {max_retries} attempts, processing chunks individually...")
+    return await asyncio.gather(
+        *[process_chunk_async(chunk_tables, tables, text_context, chunk_num, max_retries)
+          for chunk_tables, chunk_num in chunk_group],
+        return_exceptions=True
+    )
 
-async def extract_transactions(tables: Dict[str, List[List[str]]], context: Dict) -> List[Dict]:
+
+async def extract_transactions(tables: List[List[List[str]]], context: Dict, use_batch: bool = False) -> List[Dict]:
     """
     Extract transactions from tables using the context from analyze_table_structure.
     Processes tables in chunks using asyncio.gather for parallel processing.
     
     Args:
-        tables (Dict[str, List[List[str]]]): Dictionary of extracted tables
+        tables (List[List[List[str]]]): Extracted tables in document order
         context (Dict): Context from analyze_table_structure containing headers and example format
+        use_batch (bool): Submit all chunks as one OpenAI Batch API job (cheaper, but slow to complete)
     
     Returns:
-        List[Dict]: List of all extracted transactions
+        List[Dict]: List of all extracted transactions, as a PartialResult if any chunk failed
     """
     try:
-        # Sort tables by their number
-        table_keys = sorted(tables.keys(), key=lambda x: int(x.split()[1]))
-        chunk_size = 2  # Process 2 tables at a time
+        # Small statements were already extracted by analyze_table_structure
+        if 'transactions' in context:
+            print(f"   - Using the {len(context['transactions'])} transactions extracted during table analysis")
+            return context['transactions']
+
+        # Tables arrive in document order, so chunks are consecutive runs of table numbers
+        table_nums = range(1, len(tables) + 1)
         max_retries = 3
 
+        # Many small tables share a chunk; the row cap bounds the size of each chunk's response
+        avg_rows = sum(len(table_data) for table_data in tables) / len(tables) if tables else 0
+        chunk_size = calculate_dynamic_chunk_size(len(tables), avg_rows)
+        chunk_size = max(1, min(chunk_size, int(EXTRACTION_MAX_CHUNK_ROWS // max(avg_rows, 1))))
+
         # Get context information
         headers = context['available_header']
         example_transactions = context['example_transactions']
         column_types = context['column_types']
 
-        print(f"   - Processing {len(table_keys)} tables in chunks of 2 using parallel processing...")
+        print(f"   - Processing {len(tables)} tables (avg {avg_rows:.0f} rows) in chunks of {chunk_size} using parallel processing...")
 
         # Create text context from example transactions
         text_context = f"""
         Based on the analyzed tables, here's the transaction format:
-        1. Headers: {json.dumps(headers)}
-        2. Example Transaction:
-           {json.dumps(example_transactions[0], indent=2)}
-        3. Column Mapping: {json.dumps(column_types, indent=2)}
+        1. Headers: {orjson.dumps(headers).decode()}
+        2. Example Transactions:
+           {orjson.dumps(example_transactions, option=orjson.OPT_INDENT_2).decode()}
+        3. Column Mapping: {orjson.dumps(column_types, option=orjson.OPT_INDENT_2).decode()}
         """
 
         # Create chunks
         chunks = []
-        for i in range(0, len(table_keys), chunk_size):
-            chunk_tables = table_keys[i:i+chunk_size]
+        for i in range(0, len(tables), chunk_size):
+            chunk_tables = table_nums[i:i+chunk_size]
             chunk_num = i // chunk_size + 1
             chunks.append((chunk_tables, chunk_num))
 
         # Process all chunks in parallel using asyncio.gather
         start_time = time.time()
-        print(f"   🚀 Starting parallel processing of {len(chunks)} chunks at {time.strftime('%H:%M:%S')}...")
-        chunk_results = await asyncio.gather(
-            *[process_chunk_async(chunk_tables, tables, text_context, chunk_num, max_retries) 
-              for chunk_tables, chunk_num in chunks],
-            return_exceptions=True
-        )
+        if use_batch:
+            print(f"   🚀 Submitting {len(chunks)} chunks as an OpenAI batch at {time.strftime('%H:%M:%S')}...")
+            contents = await run_gpt_batch({
+                f"chunk-{chunk_num}": build_extraction_request(text_context, format_chunk_tables(chunk_tables, tables))
+                for chunk_tables, chunk_num in chunks
+            })
+            chunk_results = [
+                parse_batch_result(contents, f"chunk-{chunk_num}", lambda content: parse_extraction_response(content, chunk_num))
+                for _, chunk_num in chunks
+            ]
+        else:
+            # Pack several chunks into each request so the shared context is sent once per group
+            chunk_groups = [
+                chunks[i:i + EXTRACTION_CHUNKS_PER_REQUEST]
+                for i in range(0, len(chunks), EXTRACTION_CHUNKS_PER_REQUEST)
+            ]
+            print(f"   🚀 Starting parallel processing of {len(chunks)} chunks in {len(chunk_groups)} requests at {time.strftime('%H:%M:%S')}...")
+            group_results = await asyncio.gather(
+                *[process_chunk_group_async(chunk_group, tables, text_context, max_retries)
+                  for chunk_group in chunk_groups],
+                return_exceptions=True
+            )
+            chunk_results = []
+            for chunk_group, result in zip(chunk_groups, group_results):
+                if isinstance(result, Exception):
+                    chunk_results.extend([result] * len(chunk_group))
+                else:
+                    chunk_results.extend(result)
 
         # Combine results from all chunks
         final_transactions = []
         total_time = time.time() - start_time
         print(f"   🎉 All chunks completed in {total_time:.1f}s! Combining results...")
         
+        failed_chunks = 0
         for i, result in enumerate(chunk_results):
             if isinstance(result, Exception):
+                failed_chunks += 1
                 print(f"   ❌ Chunk {i+1} failed with exception: {str(result)}")
             elif isinstance(result, list):
                 final_transactions.extend(result)
                 print(f"   ✅ Chunk {i+1} completed with {len(result)} transactions")
             else:
+                failed_chunks += 1
                 print(f"   ❌ Chunk {i+1} returned unexpected result type: {type(result)}")
 
         if not final_transactions:
@@ -298,10 +638,13 @@ async def extract_transactions(tables: Dict[str, List[List[str]]], context: Dict
         print(f"   ✓ Total transactions extracted: {len(final_transactions)}")
         
         # Verify we have all transactions
-        expected_total = sum(len(tables[table_key]) for table_key in table_keys)
-        print(f"   - Expected transactions from {len(table_keys)} tables: ~{expected_total} (approximate)")
+        expected_total = sum(len(table) for table in tables)
+        print(f"   - Expected transactions from {len(tables)} tables: ~{expected_total} (approximate)")
         print(f"   - Actual transactions extracted: {len(final_transactions)}")
         
+        if failed_chunks:
+            print(f"   ⚠️ {failed_chunks} of {len(chunk_results)} chunks failed, returning a partial result")
+            return PartialResult(final_transactions)
         return final_transactions
 
     except Exception as e:
@@ -320,90 +663,63 @@ async def process_categorization_chunk_async(chunk: List[Dict], chunk_num: int,
     
     Returns:
         List[Dict]: List of categorized transactions from this chunk
+    
+    Raises:
+        Exception: If the chunk still fails after max_retries attempts
     """
     import time
     start_time = time.time()
     print(f"   🚀 [CATEGORY CHUNK {chunk_num}/{total_chunks}] Starting categorization ({len(chunk)} transactions)...")
-    retry_count = 0
 
-    while retry_count < max_retries:
-        try:
-            print(f"      📡 [CATEGORY CHUNK {chunk_num}] Sending to GPT API (attempt {retry_count + 1}/{max_retries})...")
-            categorization_prompt = get_categorization_prompt(chunk)
-
-            response = await openai_client.chat.completions.create(
-                model='gpt-4.1-nano',
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": "You are a financial transaction categorization expert. Categorize transactions based on their description, amount, and patterns."
-                    },
-                    {"role": "user", "content": categorization_prompt}
-                ],
-                response_format={ "type": "json_object" },
-                temperature=0.0  # Use deterministic output
-            )
+    # Only transactions whose normalized description has not been categorized before go to GPT
+    keys = [category_cache_key(tx) for tx in chunk]
+    cached_categories = [get_cached_category(key) for key in keys]
+    misses = [tx for tx, category in zip(chunk, cached_categories) if not category]
+    if len(misses) < len(chunk):
+        print(f"      💾 [CATEGORY CHUNK {chunk_num}] {len(chunk) - len(misses)} transactions categorized from cache")
+
+    async def attempt_categorization(attempt: int) -> List[Dict]:
+        print(f"      📡 [CATEGORY CHUNK {chunk_num}] Sending to GPT API (attempt {attempt + 1}/{max_retries})...")
+        # The count is checked while parsing, so a short response is never cached and the retry calls GPT again
+        return await cached_chat_create(
+            openai_client, lambda content: parse_categorization_response(content, expected_count=len(misses)),
+            gpt_rate_limiter, **build_categorization_request(misses)
+        )
 
-            result = json.loads(response.choices[0].message.content)
-            
-            # Validate response format
-            if not isinstance(result, dict) or 'transactions' not in result:
-                raise ValueError("Invalid response format")
-            
-            chunk_transactions = result['transactions']
-            
-            # Validate each transaction has required fields
-            for tx in chunk_transactions:
-                required_fields = ['date', 'description', 'debit', 'credit', 'balance', 'category']
-                if not all(field in tx for field in required_fields):
-                    raise ValueError("Missing required fields in transaction")
-                
-                # Validate category format
-                category = tx['category']
-                if not isinstance(category, str) or '.' not in category:
-                    raise ValueError(f"Invalid category format: {category}")
-                
-                category_type, subcategory = category.split('.')
-                valid_types = ['income', 'expense', 'transfer']
-                if category_type not in valid_types:
-                    raise ValueError(f"Invalid category type: {category_type}")
-            
-            elapsed = time.time() - start_time
-            print(f"      ✅ [CATEGORY CHUNK {chunk_num}] Completed in {elapsed:.1f}s - Categorized {len(chunk_transactions)} transactions")
-            return chunk_transactions
-        
-        except json.JSONDecodeError as e:
-            error_msg = f"Invalid JSON response in chunk {chunk_num}: {str(e)}"
-            print(f"      ⚠️ [CATEGORY CHUNK {chunk_num}] Warning: {error_msg}")
-            retry_count += 1
-        except ValueError as e:
-            error_msg = f"Validation error in chunk {chunk_num}: {str(e)}"
-            print(f"      ⚠️ [CATEGORY CHUNK {chunk_num}] Warning: {error_msg}")
-            retry_count += 1
-        except Exception as e:
-            error_msg = f"Error processing chunk {chunk_num}: {str(e)}"
-            print(f"      ⚠️ [CATEGORY CHUNK {chunk_num}] Warning: {error_msg}")
-            retry_count += 1
-        
-        if retry_count < max_retries:
-            print(f"      🔄 [CATEGORY CHUNK {chunk_num}] Retrying (attempt {retry_count + 1}/{max_retries})...")
+    try:
+        categorized = await retry_gpt(attempt_categorization, max_retries, f"      ⚠️ [CATEGORY CHUNK {chunk_num}]") if misses else []
+    except Exception:
+        print(f"      ❌ [CATEGORY CHUNK {chunk_num}] Failed after {max_retries} attempts")
+        # categorize_transactions applies the default categories to the failed chunk
+        raise Exception(f"Categorization chunk {chunk_num} failed after {max_retries} attempts")
+
+    # Merge cached and freshly categorized transactions back into chunk order
+    chunk_transactions = []
+    fresh = iter(categorized)
+    for tx, key, category in zip(chunk, keys, cached_categories):
+        if category:
+            chunk_transactions.append({**tx, 'category': category})
         else:
-            print(f"      ❌ [CATEGORY CHUNK {chunk_num}] Failed after {max_retries} attempts - Applying default categories")
-            # Add original transactions with default category
-            for transaction in chunk:
-                transaction['category'] = 'expense.others'  # Default category
-            return chunk
+            categorized_tx = next(fresh)
+            cache_category(key, categorized_tx['category'])
+            chunk_transactions.append(categorized_tx)
+    
+    elapsed = time.time() - start_time
+    print(f"      ✅ [CATEGORY CHUNK {chunk_num}] Completed in {elapsed:.1f}s - Categorized {len(chunk_transactions)} transactions")
+    return chunk_transactions
 
-async def categorize_transactions(transactions: List[Dict]) -> List[Dict]:
+async def categorize_transactions(transactions: List[Dict], use_batch: bool = CATEGORIZATION_USE_BATCH) -> List[Dict]:
     """
     Categorize transactions using GPT.
     Process transactions in chunks using asyncio.gather for parallel processing.
     
     Args:
         transactions (List[Dict]): List of transactions to categorize
+        use_batch (bool): Submit all chunks as one OpenAI Batch API job (cheaper, but slow to complete).
+            Ignored below CATEGORIZATION_BATCH_MIN_SIZE transactions.
     
     Returns:
-        List[Dict]: List of categorized transactions
+        List[Dict]: List of categorized transactions, as a PartialResult if any chunk got default categories
     """
     try:
         chunk_size = 40  # Process 40 transactions at a time
@@ -411,64 +727,102 @@ async def categorize_transactions(transactions: List[Dict]) -> List[Dict]:
 
         print(f"   - Input transactions count: {len(transactions)}")
 
+        # Repeated descriptions (subscriptions, salary credits) are categorized once and fanned out
+        unique_positions = {}
+        positions = [unique_positions.setdefault(category_cache_key(tx), len(unique_positions)) for tx in transactions]
+        unique_transactions = [None] * len(unique_positions)
+        for tx, position in zip(transactions, positions):
+            if unique_transactions[position] is None:
+                unique_transactions[position] = tx
+        print(f"   - Unique transactions to categorize: {len(unique_transactions)}")
+
         # Create chunks
         chunks = []
-        total_chunks = (len(transactions) + chunk_size - 1) // chunk_size
+        total_chunks = (len(unique_transactions) + chunk_size - 1) // chunk_size
         print(f"   - Creating {total_chunks} chunks with chunk_size={chunk_size}")
         
-        for i in range(0, len(transactions), chunk_size):
-            chunk = transactions[i:i + chunk_size]
+        for i in range(0, len(unique_transactions), chunk_size):
+            chunk = unique_transactions[i:i + chunk_size]
             chunk_num = i // chunk_size + 1
             chunks.append((chunk, chunk_num))
-            print(f"   - Chunk {chunk_num}: {len(chunk)} transactions (indices {i} to {min(i+chunk_size, len(transactions))-1})")
+            print(f"   - Chunk {chunk_num}: {len(chunk)} transactions (indices {i} to {min(i+chunk_size, len(unique_transactions))-1})")
 
         # Verify total transactions in chunks
         total_in_chunks = sum(len(chunk) for chunk, _ in chunks)
         print(f"   - Total transactions in chunks: {total_in_chunks}")
-        if total_in_chunks != len(transactions):
-            print(f"   ⚠️ WARNING: Transaction count mismatch! Input: {len(transactions)}, Chunks: {total_in_chunks}")
+        if total_in_chunks != len(unique_transactions):
+            print(f"   ⚠️ WARNING: Transaction count mismatch! Input: {len(unique_transactions)}, Chunks: {total_in_chunks}")
 
-        print(f"   - Processing {len(transactions)} transactions in {total_chunks} chunks using parallel categorization...")
+        print(f"   - Processing {len(unique_transactions)} transactions in {total_chunks} chunks using parallel categorization...")
 
         # Process all chunks in parallel using asyncio.gather
         start_time = time.time()
-        print(f"   🚀 Starting parallel categorization of {total_chunks} chunks at {time.strftime('%H:%M:%S')}...")
-        chunk_results = await asyncio.gather(
-            *[process_categorization_chunk_async(chunk, chunk_num, total_chunks, max_retries) 
-              for chunk, chunk_num in chunks],
-            return_exceptions=True
-        )
+        if use_batch and len(unique_transactions) >= CATEGORIZATION_BATCH_MIN_SIZE:
+            print(f"   🚀 Submitting {total_chunks} categorization chunks as an OpenAI batch at {time.strftime('%H:%M:%S')}...")
+            contents = await run_gpt_batch({
+                f"chunk-{chunk_num}": build_categorization_request(chunk) for chunk, chunk_num in chunks
+            })
+            chunk_results = [
+                parse_batch_result(
+                    contents, f"chunk-{chunk_num}",
+                    lambda content: parse_categorization_response(content, expected_count=len(chunk))
+                )
+                for chunk, chunk_num in chunks
+            ]
+        else:
+            pending = await prefill_similar_categories(unique_transactions) if CATEGORIZATION_EMBEDDING_LOOKUP else []
+            print(f"   🚀 Starting parallel categorization of {total_chunks} chunks at {time.strftime('%H:%M:%S')}...")
+            chunk_results = await asyncio.gather(
+                *[process_categorization_chunk_async(chunk, chunk_num, total_chunks, max_retries) 
+                  for chunk, chunk_num in chunks],
+                return_exceptions=True
+            )
+            learn_similar_categories(pending)
 
         # Combine results from all chunks
         categorized_transactions = []
         total_time = time.time() - start_time
         print(f"   🎉 All categorization chunks completed in {total_time:.1f}s! Combining results...")
         
-        for i, result in enumerate(chunk_results):
-            if isinstance(result, Exception):
-                print(f"   ❌ Categorization chunk {i+1} failed with exception: {str(result)}")
-                # Apply default categories to failed chunk
-                chunk_start = i * chunk_size
-                chunk_end = min(chunk_start + chunk_size, len(transactions))
-                failed_chunk = transactions[chunk_start:chunk_end]
-                for transaction in failed_chunk:
-                    transaction['category'] = 'expense.others'
-                categorized_transactions.extend(failed_chunk)
-                print(f"   ✅ Applied default categories to {len(failed_chunk)} transactions from failed chunk {i+1}")
-            elif isinstance(result, list):
+        failed_chunks = 0
+        for (chunk, chunk_num), result in zip(chunks, chunk_results):
+            # Every transaction of the chunk needs exactly one result for the fan-out below
+            if isinstance(result, list) and len(result) != len(chunk):
+                result = ValueError(f"Expected {len(chunk)} categorized transactions, got {len(result)}")
+            if isinstance(result, list):
                 categorized_transactions.extend(result)
-                print(f"   ✅ Categorization chunk {i+1} completed with {len(result)} transactions")
+                print(f"   ✅ Categorization chunk {chunk_num} completed with {len(result)} transactions")
+                continue
+
+            failed_chunks += 1
+            if isinstance(result, Exception):
+                print(f"   ❌ Categorization chunk {chunk_num} failed with exception: {str(result)}")
             else:
-                print(f"   ❌ Categorization chunk {i+1} returned unexpected result type: {type(result)}")
+                print(f"   ❌ Categorization chunk {chunk_num} returned unexpected result type: {type(result)}")
+            # Apply default categories to failed chunk
+            categorized_transactions.extend({**tx, 'category': 'expense.others'} for tx in chunk)
+            print(f"   ✅ Applied default categories to {len(chunk)} transactions from failed chunk {chunk_num}")
 
         if not categorized_transactions:
             raise Exception("No transactions were successfully categorized")
 
+        # Fan the categories out to the repeated transactions, in input order; every unique
+        # transaction has exactly one result, so each input transaction gets exactly one output
+        first_seen = set()
+        fanned_out = []
+        for tx, position in zip(transactions, positions):
+            categorized_tx = categorized_transactions[position]
+            if position in first_seen:
+                categorized_tx = {**tx, 'category': categorized_tx['category']}
+            first_seen.add(position)
+            fanned_out.append(categorized_tx)
+        categorized_transactions = fanned_out
+
         print(f"   ✓ Total transactions categorized: {len(categorized_transactions)}")
-        if len(categorized_transactions) != len(transactions):
-            print(f"   ⚠️ WARNING: Final count mismatch! Input: {len(transactions)}, Output: {len(categorized_transactions)}")
-            print(f"   ⚠️ Missing: {len(transactions) - len(categorized_transactions)} transactions")
         
+        if failed_chunks:
+            print(f"   ⚠️ {failed_chunks} of {len(chunk_results)} categorization chunks got default categories, returning a partial result")
+            return PartialResult(categorized_transactions)
         return categorized_transactions
 
     except Exception as e:
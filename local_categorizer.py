@@ -0,0 +1,87 @@
+import os
+import numpy as np
+from typing import List, Optional, Tuple
+from gpt_client import openai_client
+from dotenv import load_dotenv
+load_dotenv()
+
+# Transactions whose description embeds close to an already categorized one reuse its category
+EMBEDDING_MODEL = os.getenv('CATEGORIZATION_EMBEDDING_MODEL', 'text-embedding-3-small')
+SIMILARITY_THRESHOLD = float(os.getenv('CATEGORIZATION_SIMILARITY_THRESHOLD', 0.85))
+EMBEDDING_INDEX_MAX_ENTRIES = int(os.getenv('CATEGORIZATION_EMBEDDING_MAX_ENTRIES', 20000))
+EMBEDDING_BATCH_SIZE = 2048  # Maximum inputs per embeddings request
+
+
+class CategoryIndex:
+    """
+    In-memory nearest-neighbour index of categorized transaction texts.
+    Vectors are L2-normalized, so a dot product is the cosine similarity.
+    """
+
+    def __init__(self):
+        self.vectors = None  # (n, dim) float32
+        self.labels = []
+
+    def lookup(self, vectors: np.ndarray) -> List[Optional[str]]:
+        """
+        Category of the most similar indexed text for each vector, or None below the threshold.
+        """
+        if self.vectors is None or not len(vectors):
+            return [None] * len(vectors)
+        similarities = vectors @ self.vectors.T
+        best = similarities.argmax(axis=1)
+        return [
+            self.labels[index] if similarities[row, index] >= SIMILARITY_THRESHOLD else None
+            for row, index in enumerate(best)
+        ]
+
+    def add(self, vectors: np.ndarray, labels: List[str]) -> None:
+        """
+        Index categorized texts, keeping only the most recent EMBEDDING_INDEX_MAX_ENTRIES.
+        """
+        if not labels:
+            return
+        self.vectors = vectors if self.vectors is None else np.vstack((self.vectors, vectors))
+        self.labels.extend(labels)
+        if len(self.labels) > EMBEDDING_INDEX_MAX_ENTRIES:
+            self.vectors = self.vectors[-EMBEDDING_INDEX_MAX_ENTRIES:]
+            self.labels = self.labels[-EMBEDDING_INDEX_MAX_ENTRIES:]
+
+
+category_index = CategoryIndex()
+
+
+async def embed_texts(texts: List[str]) -> np.ndarray:
+    """
+    Embed texts with the OpenAI embeddings API in as few requests as possible.
+    
+    Returns:
+        np.ndarray: L2-normalized float32 vectors, one row per text
+    """
+    rows = []
+    for i in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        response = await openai_client.embeddings.create(model=EMBEDDING_MODEL, input=texts[i:i + EMBEDDING_BATCH_SIZE])
+        rows.extend(item.embedding for item in response.data)
+    vectors = np.asarray(rows, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+async def find_similar_categories(texts: List[str]) -> Tuple[List[Optional[str]], np.ndarray]:
+    """
+    Look up categories for transaction texts by embedding similarity.
+    
+    Args:
+        texts (List[str]): Normalized transaction texts
+    
+    Returns:
+        Tuple[List[Optional[str]], np.ndarray]: (category or None per text, the texts' vectors)
+    """
+    vectors = await embed_texts(texts)
+    return category_index.lookup(vectors), vectors
+
+
+def remember_categories(vectors: np.ndarray, labels: List[str]) -> None:
+    """
+    Add GPT-categorized texts to the index so later statements can match them.
+    """
+    category_index.add(vectors, labels)
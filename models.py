@@ -16,4 +16,44 @@ class AnalysisResponse(BaseModel):
 class HomeResponse(BaseModel):
     status: str
     message: str
-    endpoints: Dict[str, str] 
\ No newline at end of file
+    endpoints: Dict[str, str] 
+
+# Structured Outputs schemas: GPT responses are constrained to these server-side
+
+class ColumnTypes(BaseModel):
+    date_column: int
+    description_column: int
+    debit_column: int
+    credit_column: int
+    balance_column: int
+
+class TableAnalysis(BaseModel):
+    available_header: List[str]
+    example_transactions: List[List[str]]
+    column_types: ColumnTypes
+
+class ExtractedTransaction(BaseModel):
+    date: str
+    description: str
+    debit: float
+    credit: float
+    balance: float
+
+class TransactionList(BaseModel):
+    transactions: List[ExtractedTransaction]
+
+class TableAnalysisWithTransactions(TableAnalysis):
+    transactions: List[ExtractedTransaction]
+
+class ChunkTransactions(BaseModel):
+    id: int
+    transactions: List[ExtractedTransaction]
+
+class ChunkTransactionList(BaseModel):
+    chunks: List[ChunkTransactions]
+
+class CategorizedTransaction(ExtractedTransaction):
+    category: str
+
+class CategorizedTransactionList(BaseModel):
+    transactions: List[CategorizedTransaction]
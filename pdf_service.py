@@ -2,6 +2,11 @@ import PyPDF2
 from io import BytesIO
 from typing import Tuple, Optional
 
+# Bytes at the end of a PDF searched for the trailer before falling back to a full parse
+PDF_TRAILER_SCAN_BYTES = 65536
+# Bytes at the start searched too: linearized PDFs put the first-page trailer near the head
+PDF_HEAD_SCAN_BYTES = 4096
+
 class PDFPasswordError(Exception):
     """Exception raised when PDF password is required but not provided"""
     pass
@@ -10,6 +15,16 @@ class PDFProcessingError(Exception):
     """Exception raised when PDF processing fails"""
     pass
 
+def _open_pdf(file_content: bytes) -> Tuple[PyPDF2.PdfReader, bool]:
+    """
+    Parse a PDF once so the same reader can be checked, validated and unlocked.
+    
+    Returns:
+        Tuple[PyPDF2.PdfReader, bool]: (reader, is_encrypted)
+    """
+    pdf_reader = PyPDF2.PdfReader(BytesIO(file_content))
+    return pdf_reader, pdf_reader.is_encrypted
+
 def check_pdf_password_protection(file_content: bytes) -> bool:
     """
     Check if a PDF file is password protected.
@@ -20,9 +35,15 @@ def check_pdf_password_protection(file_content: bytes) -> bool:
     Returns:
         bool: True if PDF is password protected, False otherwise
     """
+    # Encryption is declared by an /Encrypt entry in the trailer, so the tail of the file
+    # (and the head, for linearized files) settles the common unencrypted case without
+    # parsing the cross-reference table
+    tail = file_content[-PDF_TRAILER_SCAN_BYTES:]
+    head = file_content[:PDF_HEAD_SCAN_BYTES]
+    if b'trailer' in tail and b'/Encrypt' not in tail and b'/Encrypt' not in head:
+        return False
     try:
-        pdf_reader = PyPDF2.PdfReader(BytesIO(file_content))
-        return pdf_reader.is_encrypted
+        return _open_pdf(file_content)[1]
     except Exception as e:
         # If PyPDF2 fails to read, assume it's not password protected
         return False
@@ -43,33 +64,57 @@ def unlock_pdf_with_password(file_content: bytes, password: str) -> bytes:
         PDFProcessingError: If PDF processing fails
     """
     try:
-        pdf_reader = PyPDF2.PdfReader(BytesIO(file_content))
-        if pdf_reader.is_encrypted:
-            if pdf_reader.decrypt(password):
-                # Create a new PDF writer
-                pdf_writer = PyPDF2.PdfWriter()
-                
-                # Add all pages from the decrypted reader
-                for page in pdf_reader.pages:
-                    pdf_writer.add_page(page)
-                
-                # Write to bytes buffer
-                output_buffer = BytesIO()
-                pdf_writer.write(output_buffer)
-                output_buffer.seek(0)
-                
-                return output_buffer.getvalue()
-            else:
-                raise PDFPasswordError("Incorrect password provided")
-        else:
+        pdf_reader, is_encrypted = _open_pdf(file_content)
+        if not is_encrypted:
             # PDF is not encrypted, return original content
             return file_content
+        return _unlock_reader(pdf_reader, password)
+            
+    except (PDFPasswordError, PDFProcessingError):
+        raise
+    except Exception as e:
+        raise PDFProcessingError(f"Failed to unlock PDF: {str(e)}")
+
+def _unlock_reader(pdf_reader: PyPDF2.PdfReader, password: str) -> bytes:
+    """
+    Decrypt an encrypted reader and serialize it as an unencrypted PDF.
+    
+    Raises:
+        PDFPasswordError: If password is incorrect
+        PDFProcessingError: If PDF processing fails
+    """
+    try:
+        if not pdf_reader.decrypt(password):
+            raise PDFPasswordError("Incorrect password provided")
+        
+        # Copy the decrypted pages into an unencrypted PDF in one pass
+        pdf_writer = PyPDF2.PdfWriter()
+        pdf_writer.append_pages_from_reader(pdf_reader)
+        
+        output_buffer = BytesIO()
+        pdf_writer.write(output_buffer)
+        return output_buffer.getvalue()
             
     except PDFPasswordError:
         raise
     except Exception as e:
         raise PDFProcessingError(f"Failed to unlock PDF: {str(e)}")
 
+def get_pdf_page_count(file_content: bytes) -> Optional[int]:
+    """
+    Count the pages of a PDF without rendering it.
+    
+    Args:
+        file_content (bytes): PDF file content as bytes
+    
+    Returns:
+        Optional[int]: Number of pages, or None if the PDF cannot be read
+    """
+    try:
+        return len(PyPDF2.PdfReader(BytesIO(file_content)).pages)
+    except Exception:
+        return None
+
 def validate_pdf_file(file_content: bytes) -> Tuple[bool, Optional[str]]:
     """
     Validate PDF file and check if it's password protected.
@@ -82,8 +127,16 @@ def validate_pdf_file(file_content: bytes) -> Tuple[bool, Optional[str]]:
     """
     try:
         # Check if it's a valid PDF
-        pdf_reader = PyPDF2.PdfReader(BytesIO(file_content))
-        
+        pdf_reader, _ = _open_pdf(file_content)
+    except Exception as e:
+        return False, f"Invalid PDF file: {str(e)}"
+    return _validate_reader(pdf_reader)
+
+def _validate_reader(pdf_reader: PyPDF2.PdfReader) -> Tuple[bool, Optional[str]]:
+    """
+    Validate an already parsed PDF, see validate_pdf_file.
+    """
+    try:
         # Check if it's password protected
         if pdf_reader.is_encrypted:
             return False, "PDF is password protected. Please provide the password."
@@ -113,16 +166,22 @@ def process_pdf_file(file_content: bytes, password: Optional[str] = None) -> byt
         PDFProcessingError: If PDF processing fails
     """
     try:
+        # Parse once and reuse the reader for the protection check, unlocking and validation
+        try:
+            pdf_reader, is_encrypted = _open_pdf(file_content)
+        except Exception as e:
+            raise PDFProcessingError(f"Invalid PDF file: {str(e)}")
+        
         # Check if PDF is password protected
-        if check_pdf_password_protection(file_content):
+        if is_encrypted:
             if password is None:
                 raise PDFPasswordError("PDF is password protected. Please provide a password.")
             
             # Unlock the PDF with the provided password
-            return unlock_pdf_with_password(file_content, password)
+            return _unlock_reader(pdf_reader, password)
         else:
             # PDF is not password protected, validate and return
-            is_valid, error_message = validate_pdf_file(file_content)
+            is_valid, error_message = _validate_reader(pdf_reader)
             if not is_valid:
                 raise PDFProcessingError(error_message)
             
@@ -1,54 +1,100 @@
 from collections import defaultdict
+import os
+import time
 import asyncio
-import json
+import gzip
+import orjson
+
+# Results may carry numpy scalars and non-string keys from the pandas summaries
+SSE_DUMPS_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+# Finished results are kept gzip-compressed in memory until fetched; tiny ones are not worth it
+RESULT_COMPRESS_MIN_BYTES = 512
+RESULT_COMPRESS_LEVEL = 6
+# Pending SSE events per task; when nobody reads them the oldest intermediate ones are dropped
+PROGRESS_QUEUE_MAX_EVENTS = 16
+# Finished tasks (progress, result) are forgotten after this long (seconds)
+TASK_RETENTION_SECONDS = int(os.getenv('TASK_RETENTION_SECONDS', 3600))
 
 class progress_manager:
     def __init__(self):
         self.listeners = {}
         self.progress_data = {}
+        self.results = {}
+        self.finished_at = {}
 
     def init_task(self, task_id: str):
+        self.prune_finished_tasks()
         self.progress_data[task_id] = {
             "progress": 0,
             "message": "Task initialized.",
             "data": None
         }
-        self.listeners[task_id] = asyncio.Queue()
+        self.listeners[task_id] = asyncio.Queue(maxsize=PROGRESS_QUEUE_MAX_EVENTS)
+
+    def prune_finished_tasks(self):
+        """Drop the state of tasks that finished more than TASK_RETENTION_SECONDS ago."""
+        cutoff = time.time() - TASK_RETENTION_SECONDS
+        for task_id in [t for t, finished in self.finished_at.items() if finished < cutoff]:
+            del self.finished_at[task_id]
+            self.progress_data.pop(task_id, None)
+            self.results.pop(task_id, None)
+            self.listeners.pop(task_id, None)
 
     async def update_progress(self, task_id: str, progress: int, message: str, data: dict = None):
         if task_id not in self.progress_data:
             self.init_task(task_id)
 
         # Persist progress data
-        self.progress_data[task_id] = {
-            "progress": progress,
-            "message": message,
-            "data": data
-        }
-
-        payload = {
-            "progress": progress,
-            "message": message,
-            "data": data
-        }
+        self.progress_data[task_id].update(progress=progress, message=message, data=data)
+        if progress >= 100:
+            self.finished_at[task_id] = time.time()
 
-        if task_id in self.listeners:
-            await self.listeners[task_id].put(payload)
+        queue = self.listeners.get(task_id)
+        if queue is not None:
+            if queue.full():
+                # Nobody is reading: drop the oldest event so the final one always fits
+                queue.get_nowait()
+            queue.put_nowait(dict(self.progress_data[task_id]))
 
     async def listen(self, task_id: str):
-        if task_id not in self.listeners:
-            yield f"data: {json.dumps({'error': 'Task not found'})}\n\n"
+        if task_id not in self.progress_data:
+            yield f"data: {orjson.dumps({'error': 'Task not found'}).decode()}\n\n"
             return
 
-        while True:
-            data = await self.listeners[task_id].get()
-            yield f"data: {json.dumps(data)}\n\n"
+        queue = self.listeners.get(task_id)
+        if queue is None:
+            # A previous listener went away: resume from the latest state
+            data = self.progress_data[task_id]
+            yield f"data: {orjson.dumps(data, option=SSE_DUMPS_OPTIONS).decode()}\n\n"
             if data["progress"] >= 100:
-                break
+                return
+            queue = self.listeners[task_id] = asyncio.Queue(maxsize=PROGRESS_QUEUE_MAX_EVENTS)
+
+        try:
+            while True:
+                data = await queue.get()
+                yield f"data: {orjson.dumps(data, option=SSE_DUMPS_OPTIONS).decode()}\n\n"
+                if data["progress"] >= 100:
+                    break
+        finally:
+            # Finished or disconnected; later updates are not queued until someone listens again
+            if self.listeners.get(task_id) is queue:
+                del self.listeners[task_id]
 
     def get_progress(self, task_id: str):
         return self.progress_data.get(task_id, None)
 
+    def set_result(self, task_id: str, result: dict):
+        body = orjson.dumps(result, option=SSE_DUMPS_OPTIONS)
+        gzipped = len(body) >= RESULT_COMPRESS_MIN_BYTES
+        if gzipped:
+            body = gzip.compress(body, compresslevel=RESULT_COMPRESS_LEVEL)
+        self.results[task_id] = (body, gzipped)
+
+    def get_result(self, task_id: str):
+        """Return the stored (JSON body, is_gzipped) pair for a task, or None."""
+        return self.results.get(task_id, None)
+
     def complete_task(self, task_id: str, final_data: dict = None):
         if task_id in self.progress_data:
             self.progress_data[task_id].update({
@@ -56,6 +102,7 @@ class progress_manager:
                 "message": "Processing complete!",
                 "data": final_data
             })
+            self.finished_at[task_id] = time.time()
 
 
 progress_manager = progress_manager()
\ No newline at end of file
@@ -1,3 +1,4 @@
+from functools import lru_cache
 # import json
 
 # def get_analysis_prompt(combined_text: str) -> str:
@@ -214,7 +215,7 @@
 #     {json.dumps(transactions, indent=2)}
 #     """
 
-import json
+import orjson
 
 # def get_analysis_prompt(combined_text: str) -> str:
 #     return f"""
@@ -270,6 +271,40 @@ def get_analysis_prompt(combined_text: str) -> str:
     """
 
 
+def get_analysis_with_extraction_prompt(combined_text: str) -> str:
+    return f"""
+    Analyze the following extracted bank statement tables and extract their transactions.
+
+    Tasks:
+    1. Identify the headers.
+    2. Provide the first 5 transactions aligned with these headers.
+    3. Map each header to its type: date, description, debit, credit, balance.
+    4. Extract all valid financial transactions from the tables.
+
+    STRICTLY return a valid JSON object with:
+    {{
+        "available_header": ["column1", "column2", ...],
+        "example_transactions": [["value1", "value2", ...], ...],
+        "column_types": {{
+            "date_column": index,
+            "description_column": index,
+            "debit_column": index,
+            "credit_column": index,
+            "balance_column": index
+        }},
+        "transactions": [
+            {{"date": "DD-MM-YYYY", "description": "...", "debit": number, "credit": number, "balance": number}},
+            ...
+        ]
+    }}
+
+    Use double quotes only. Return ONLY the JSON — no explanation, no comments.
+
+    Tables:
+    {combined_text}
+    """
+
+
 # def get_extraction_prompt(text_context: str, combined_text: str) -> str:
 #     return f"""
 #     Extract only valid financial transactions from the provided bank statement tables.
@@ -288,10 +323,12 @@ def get_analysis_prompt(combined_text: str) -> str:
 #     {combined_text}
 #     """
 
-def get_extraction_prompt(text_context: str, combined_text: str) -> str:
+# The extraction instructions and text context are identical for every chunk of a statement,
+# so they are sent as their own message ahead of the tables; OpenAI caches repeated prompt prefixes.
+@lru_cache(maxsize=32)
+def get_extraction_prefix(text_context: str) -> str:
     return f"""
-    Extract valid financial transactions from the provided bank statement tables using the context below:
-    {text_context}
+    Extract valid financial transactions from the provided bank statement tables.
 
     Return a valid JSON object with this exact structure:
     {{
@@ -303,8 +340,52 @@ def get_extraction_prompt(text_context: str, combined_text: str) -> str:
 
     Use double quotes. Return ONLY the JSON. Do not add any explanation or text.
 
+    Use the context below:
+    {text_context}
+    """
+
+
+def get_extraction_prompt(dynamic_tables: str) -> str:
+    return f"""
     Tables:
-    {combined_text}
+    {dynamic_tables}
+    """
+
+
+@lru_cache(maxsize=32)
+def get_multi_chunk_extraction_prefix(text_context: str) -> str:
+    return f"""
+    Extract valid financial transactions from the provided bank statement tables.
+
+    The tables are split into chunks marked "=== CHUNK <id> ===". Extract each chunk separately
+    and return a valid JSON object with this exact structure, one entry per chunk:
+    {{
+        "chunks": [
+            {{
+                "id": <chunk id>,
+                "transactions": [
+                    {{"date": "DD-MM-YYYY", "description": "...", "debit": number, "credit": number, "balance": number}},
+                    ...
+                ]
+            }},
+            ...
+        ]
+    }}
+
+    Use double quotes. Return ONLY the JSON. Do not add any explanation or text.
+
+    Use the context below:
+    {text_context}
+    """
+
+
+def get_multi_chunk_extraction_prompt(chunk_texts: dict) -> str:
+    chunk_blocks = "\n".join(
+        f"=== CHUNK {chunk_id} ===\n{combined_text}" for chunk_id, combined_text in chunk_texts.items()
+    )
+    return f"""
+    Tables:
+    {chunk_blocks}
     """
 
 
@@ -332,8 +413,9 @@ def get_extraction_prompt(text_context: str, combined_text: str) -> str:
 #     {json.dumps(transactions, indent=2)}
 #     """
 
-def get_categorization_prompt(transactions: list) -> str:
-    return f"""
+# Static, so it goes in the system message and only the transactions vary between requests
+def get_categorization_instructions() -> str:
+    return """
     Categorize each transaction into one of the following:
 
     - Income: income.salary, income.interest, income.business, income.refund, income.others
@@ -343,17 +425,22 @@ def get_categorization_prompt(transactions: list) -> str:
     Use the transaction description, amount, and pattern to decide. Do not create new categories.
 
     Return JSON in the following format:
-    {{
+    {
         "transactions": [
-            {{"date": "YYYY-MM-DD", "description": "...", "debit": number, "credit": number, "balance": number, "category": "exact.subcategory"}},
+            {"date": "YYYY-MM-DD", "description": "...", "debit": number, "credit": number, "balance": number, "category": "exact.subcategory"},
             ...
         ]
-    }}
+    }
 
     Use double quotes and strict JSON formatting. Return ONLY the JSON without any comments or extra text.
+    """
 
+
+# Transactions are sent as compact JSON; indentation would only add input tokens
+def get_categorization_prompt(transactions: list) -> str:
+    return f"""
     Transactions:
-    {json.dumps(transactions, indent=2)}
+    {orjson.dumps(transactions).decode()}
     """
 
 
@@ -0,0 +1,113 @@
+import re
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+
+WINDOW_SECONDS = 60.0
+DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+DURATION_UNITS = {'ms': 0.001, 's': 1.0, 'm': 60.0, 'h': 3600.0}
+
+
+def parse_reset_duration(value: str) -> float:
+    """
+    Parse an OpenAI x-ratelimit-reset-* header such as "20ms", "1s" or "6m0s" into seconds.
+    """
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in DURATION_PART.findall(value or ''))
+
+
+class AsyncRateLimiter:
+    """
+    Client-side limit on concurrent requests, requests per minute and tokens per minute.
+    The per-minute budgets are tracked over a sliding window and tightened from the
+    x-ratelimit-* headers OpenAI returns, so requests wait instead of failing with a 429.
+    """
+
+    def __init__(self, rpm: int = 5000, tpm: int = 1_500_000, max_concurrent: int = 20):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.sem = asyncio.Semaphore(max_concurrent)
+        self.window = deque()  # [timestamp, tokens, in_window] per request, oldest first
+        self.window_tokens = 0
+        # Latest server-reported budgets (None until the first response)
+        self.remaining_requests = None
+        self.remaining_tokens = None
+        self.requests_reset_at = 0.0
+        self.tokens_reset_at = 0.0
+        self.lock = asyncio.Lock()
+
+    def _prune(self, now: float) -> None:
+        while self.window and now - self.window[0][0] >= WINDOW_SECONDS:
+            entry = self.window.popleft()
+            entry[2] = False
+            self.window_tokens -= entry[1]
+
+    def _wait_time(self, tokens: int, now: float) -> float:
+        waits = []
+        if len(self.window) >= self.rpm or (self.window and self.window_tokens + tokens > self.tpm):
+            waits.append(self.window[0][0] + WINDOW_SECONDS - now)
+        if self.remaining_requests is not None and self.remaining_requests <= 0 and now < self.requests_reset_at:
+            waits.append(self.requests_reset_at - now)
+        if self.remaining_tokens is not None and self.remaining_tokens < tokens and now < self.tokens_reset_at:
+            waits.append(self.tokens_reset_at - now)
+        return max(waits, default=0.0)
+
+    async def acquire(self, tokens: int) -> list:
+        """
+        Wait until a request of about `tokens` tokens fits the budgets and reserve it.
+        
+        Returns:
+            list: Window entry for the request, so the estimate can be corrected later
+        """
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self._prune(now)
+                wait = self._wait_time(tokens, now)
+                if wait <= 0:
+                    break
+                print(f"⏳ Rate limit budget reached, waiting {wait:.1f}s")
+                await asyncio.sleep(wait)
+
+            entry = [now, tokens, True]
+            self.window.append(entry)
+            self.window_tokens += tokens
+            if self.remaining_requests is not None:
+                self.remaining_requests -= 1
+            if self.remaining_tokens is not None:
+                self.remaining_tokens -= tokens
+            return entry
+
+    def record_usage(self, entry: list, tokens: int) -> None:
+        """
+        Replace the token estimate of a finished request with its actual usage.
+        """
+        if entry[2]:
+            self.window_tokens += tokens - entry[1]
+        entry[1] = tokens
+
+    def update_from_headers(self, headers) -> None:
+        """
+        Tighten the budgets from a response's x-ratelimit-* headers.
+        """
+        now = time.monotonic()
+        try:
+            if 'x-ratelimit-remaining-requests' in headers:
+                self.remaining_requests = int(headers['x-ratelimit-remaining-requests'])
+                self.requests_reset_at = now + parse_reset_duration(headers.get('x-ratelimit-reset-requests'))
+            if 'x-ratelimit-remaining-tokens' in headers:
+                self.remaining_tokens = int(headers['x-ratelimit-remaining-tokens'])
+                self.tokens_reset_at = now + parse_reset_duration(headers.get('x-ratelimit-reset-tokens'))
+        except ValueError:
+            pass
+
+    @asynccontextmanager
+    async def limit(self, tokens: int):
+        """
+        Hold a concurrency slot and a per-minute reservation for one request.
+        
+        Yields:
+            list: Window entry for `record_usage`
+        """
+        async with self.sem:
+            yield await self.acquire(tokens)